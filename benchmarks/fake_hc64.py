@@ -0,0 +1,313 @@
+"""
+Stand-in for the HTTP API of the BMR HC64 controller.
+
+Emulates the endpoints used by the integration (circuits, schedules, circuit
+schedule assignments, summer mode, low mode, HDO, roller shutters) closely
+enough for the integration to work against it. Every response can be delayed
+to emulate the slow embedded web server of the real controller. The server
+counts the requests and connections it receives so the cost of the
+integration can be measured.
+
+Like the real controller it remembers the logged-in client by its address
+and answers with the login page until the client logs in. With
+--login-timeout the login is forgotten after that many seconds.
+
+Run it standalone and point the integration at it:
+
+    python -m benchmarks.fake_hc64 --circuits 8 --latency 0.2 --port 8080
+
+GET /__stats returns the request counters as JSON, POST /__reset clears
+them.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import weakref
+from datetime import datetime
+
+from aiohttp import web
+
+MAX_CIRCUITS = 64
+NUM_SCHEDULES = 32
+NUM_DAYS = 21
+
+LOGIN_PAGE = '<html><form action="menu.html"><input name="loginName"><input name="passwd"></form></html>'
+
+
+class FakeHC64:
+    """ State of the emulated controller and the request handler.
+    """
+
+    def __init__(self, circuits=8, latency=0.0, seed=0, login_timeout=None, shutters=0, travel_time=0.0):
+        if not 0 <= circuits <= MAX_CIRCUITS:
+            raise ValueError(f"Number of circuits must be 0-{MAX_CIRCUITS}")
+        self.circuits = circuits
+        self.latency = latency
+        self.login_timeout = login_timeout
+        self._random = random.Random(seed)
+
+        self.names = [f"Room {circuit_id}" for circuit_id in range(circuits)]
+        self.temperatures = [20.0 + self._random.random() * 2 for _ in range(circuits)]
+        self.schedules = {
+            schedule_id: (f"Schedule {schedule_id}", [("00:00", 21), ("06:00", 22), ("22:00", 20)])
+            for schedule_id in range(NUM_SCHEDULES)
+        }
+        self.circuit_schedules = {circuit_id: (1, [circuit_id % NUM_SCHEDULES]) for circuit_id in range(circuits)}
+        self.summer_mode = False
+        self.summer_mode_assignments = [False] * MAX_CIRCUITS
+        self.low_mode = "018"
+        self.low_mode_assignments = [False] * MAX_CIRCUITS
+        self.hdo = False
+
+        # Roller shutters: [name, position, tilt, time of the last change]
+        self.travel_time = travel_time
+        self.shutters = [[f"Shutter {shutter_id}", 0, 0, 0.0] for shutter_id in range(shutters)]
+
+        # Client address -> time of the login
+        self.logins = {}
+
+        self.requests = {}
+        self.connections = 0
+        self._transports = weakref.WeakSet()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def reset_stats(self):
+        self.requests = {}
+        self.connections = 0
+        self.max_in_flight = 0
+
+    def stats(self):
+        return {
+            "requests": dict(self.requests),
+            "total": sum(self.requests.values()),
+            "connections": self.connections,
+            "max_in_flight": self.max_in_flight,
+        }
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get("/__stats", self._handle_stats)
+        app.router.add_post("/__reset", self._handle_reset)
+        app.router.add_post("/{path:.*}", self._handle)
+        return app
+
+    async def _handle_stats(self, request):
+        return web.json_response(self.stats())
+
+    async def _handle_reset(self, request):
+        self.reset_stats()
+        return web.json_response({})
+
+    async def _handle(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if request.transport not in self._transports:
+                self._transports.add(request.transport)
+                self.connections += 1
+            path = request.path
+            self.requests[path] = self.requests.get(path, 0) + 1
+            handler = getattr(self, "_" + path.strip("/").replace(".", "_"), None)
+            if handler is None:
+                raise web.HTTPNotFound()
+            data = await request.post()
+            if path == "/menu.html":
+                self.logins[request.remote] = time.monotonic()
+            elif not self._logged_in(request.remote):
+                return web.Response(text=LOGIN_PAGE, content_type="text/html", charset="iso-8859-1")
+            return web.Response(text=handler(data), content_type="text/html", charset="iso-8859-1")
+        finally:
+            self.in_flight -= 1
+
+    # Login
+
+    def _logged_in(self, remote):
+        login = self.logins.get(remote)
+        if login is None:
+            return False
+        return self.login_timeout is None or time.monotonic() - login < self.login_timeout
+
+    def _menu_html(self, data):
+        return "<html>ok</html>"
+
+    # Circuits
+
+    def _numOfRooms(self, data):
+        return str(self.circuits)
+
+    def _listOfRooms(self, data):
+        return "".join(f"{name:13.13}" for name in self.names)
+
+    def _wholeRoom(self, data):
+        circuit_id = int(data["param"])
+        if not 0 <= circuit_id < self.circuits:
+            return ""
+        target = self._target_temperature(circuit_id)
+        temperature = self.temperatures[circuit_id]
+        temperature += self._random.uniform(-0.1, 0.1) + (0.05 if target > temperature else -0.05)
+        self.temperatures[circuit_id] = temperature
+        summer = self.summer_mode and self.summer_mode_assignments[circuit_id]
+        low = self._low_mode_enabled() and self.low_mode_assignments[circuit_id]
+        heating = not summer and temperature < target
+        return "1{:13.13}{:05.1f}{:03d}{:05.1f}+00.002.0{:d}00000{:d}{:d}0".format(
+            self.names[circuit_id], temperature, int(target), target, heating, low, summer
+        )
+
+    def _target_temperature(self, circuit_id):
+        if self.summer_mode and self.summer_mode_assignments[circuit_id]:
+            return 0
+        if self._low_mode_enabled() and self.low_mode_assignments[circuit_id]:
+            return int(self.low_mode[:3])
+        starting_day, day_schedules = self.circuit_schedules[circuit_id]
+        schedule_id = day_schedules[self._current_day(starting_day, day_schedules)]
+        now = datetime.now().strftime("%H:%M")
+        return [temperature for time_, temperature in self.schedules[schedule_id][1] if time_ <= now][-1]
+
+    def _current_day(self, starting_day, day_schedules):
+        return (datetime.now().toordinal() + starting_day - 1) % len(day_schedules)
+
+    # Schedules
+
+    def _listOfModes(self, data):
+        return "".join(f"{name:13.13}" for name, _ in self.schedules.values())
+
+    def _loadMode(self, data):
+        name, timetable = self.schedules[int(data["modeID"])]
+        return f"{name:13.13}" + "".join(f"{time_}{temperature:03d}" for time_, temperature in timetable)
+
+    def _saveMode(self, data):
+        value = data["modeSettings"]
+        timetable = [(value[i : i + 5], int(value[i + 5 : i + 8])) for i in range(15, len(value), 8)]
+        self.schedules[int(value[:2])] = (value[2:15].rstrip(), timetable)
+        return "true"
+
+    def _roomSettings(self, data):
+        circuit_id = int(data["roomID"])
+        starting_day, day_schedules = self.circuit_schedules.get(circuit_id, (1, [0]))
+        current = self._current_day(starting_day, day_schedules)
+        values = [
+            schedule_id | 0b100000 if day == current else schedule_id for day, schedule_id in enumerate(day_schedules)
+        ]
+        values += [-1] * (NUM_DAYS - len(values))
+        return f"{starting_day:02d}" + "".join(f"{value:02d}" for value in values)
+
+    def _saveAssignmentModes(self, data):
+        value = data["roomSettings"]
+        day_schedules = [int(value[i : i + 2]) for i in range(4, len(value), 2)]
+        self.circuit_schedules[int(value[:2])] = (int(value[2:4]), [x for x in day_schedules if x != -1])
+        return "true"
+
+    # Summer mode
+
+    def _loadSummerMode(self, data):
+        return "0" if self.summer_mode else "1"
+
+    def _saveSummerMode(self, data):
+        self.summer_mode = data["summerMode"] == "0"
+        return "true"
+
+    def _letoLoadRooms(self, data):
+        return "".join(str(int(value)) for value in self.summer_mode_assignments)
+
+    def _letoSaveRooms(self, data):
+        self.summer_mode_assignments = [value == "1" for value in data["value"]]
+        return "true"
+
+    # Low mode
+
+    def _low_mode_enabled(self):
+        return len(self.low_mode) > 3
+
+    def _loadLows(self, data):
+        return self.low_mode
+
+    def _lowSave(self, data):
+        self.low_mode = data["lowData"].strip()
+        return "true"
+
+    def _lowLoadRooms(self, data):
+        return "".join(str(int(value)) for value in self.low_mode_assignments)
+
+    def _lowSaveRooms(self, data):
+        self.low_mode_assignments = [value == "1" for value in data["value"]]
+        return "true"
+
+    # HDO
+
+    def _loadHDO(self, data):
+        return "1" if self.hdo else "0"
+
+    # Roller shutters
+
+    def _numOfRollerShutters(self, data):
+        return str(len(self.shutters))
+
+    def _listOfRollerShutters(self, data):
+        return "".join(f"{name:13.13}" for name, _, _, _ in self.shutters)
+
+    def _wholeRollerShutter(self, data):
+        name, position, tilt, changed = self.shutters[int(data["rollerShutter"])]
+        # While the shutter moves the controller reports a position in
+        # between, use "half".
+        if time.monotonic() - changed < self.travel_time:
+            position = 3
+        return f"1{name:13.13}{position:01d}{tilt:02d}" + "0" * 16
+
+    def _saveManualChange(self, data):
+        value = data["manualChange"]
+        self.shutters[int(value[:2])][1:] = [int(value[2]), int(value[3:5]), time.monotonic()]
+        return "true"
+
+
+async def async_start(fake, host="127.0.0.1", port=8080):
+    """ Start serving the fake controller. Return the runner, call its
+        cleanup() to stop.
+    """
+    runner = web.AppRunner(fake.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake BMR HC64 controller")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--circuits", type=int, default=8, help="number of circuits (0-64)")
+    parser.add_argument("--latency", type=float, default=0.0, help="response latency in seconds")
+    parser.add_argument("--login-timeout", type=float, help="forget the login after this many seconds")
+    parser.add_argument("--shutters", type=int, default=0, help="number of roller shutters")
+    parser.add_argument("--travel-time", type=float, default=0.0, help="travel time of the shutters in seconds")
+    args = parser.parse_args()
+
+    async def serve():
+        fake = FakeHC64(
+            args.circuits,
+            args.latency,
+            login_timeout=args.login_timeout,
+            shutters=args.shutters,
+            travel_time=args.travel_time,
+        )
+        runner = await async_start(fake, args.host, args.port)
+        print(f"Fake BMR HC64 listening on http://{args.host}:{args.port}/")
+        try:
+            while True:
+                await asyncio.sleep(60)
+                print(time.strftime("%H:%M:%S"), json.dumps(fake.stats()))
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
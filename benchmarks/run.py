@@ -0,0 +1,229 @@
+"""
+Polling benchmark of the BMR HC64 integration.
+
+Sets up the climate, sensor, switch and binary_sensor platforms in a
+throw-away Home Assistant instance against the fake controller
+(benchmarks/fake_hc64.py) and measures what one update cycle costs:
+
+- requests: HTTP requests the controller received per cycle
+- connections: TCP connections the controller accepted per cycle
+- wall: wall time of the cycle
+- loop: CPU time spent in the event loop thread during the cycle
+- executor: jobs submitted to the executor during the cycle
+
+The first cycle after startup reads everything (full), the following cycles
+read only the fast tier (steady). Requires Home Assistant to be installed:
+
+    python -m benchmarks.run --circuits 1 8 32 64 --latency 0.05
+
+Use --json to get machine readable results, e.g. to compare two revisions.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+from .fake_hc64 import FakeHC64, async_start
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMPONENT = os.path.join(ROOT, "custom_components", "bmr")
+DOMAIN = "bmr_hc64"
+
+
+class FakeServerThread(threading.Thread):
+    """ Run the fake controller in its own thread and event loop, so its
+        work isn't accounted to the event loop of Home Assistant.
+    """
+
+    def __init__(self, fake, port):
+        super().__init__(daemon=True)
+        self.fake = fake
+        self.port = port
+        self.loop = asyncio.new_event_loop()
+        self._started = threading.Event()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.runner = self.loop.run_until_complete(async_start(self.fake, port=self.port))
+        self._started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+
+    def start(self):
+        super().start()
+        self._started.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.join()
+
+    def call(self, func):
+        """ Call the function in the server thread and return its result.
+        """
+        return asyncio.run_coroutine_threadsafe(self._async_call(func), self.loop).result()
+
+    async def _async_call(self, func):
+        return func()
+
+
+class ExecutorProbe:
+    """ Count jobs submitted to the executor of the loop.
+    """
+
+    def __init__(self, loop):
+        self.jobs = 0
+        original = loop.run_in_executor
+
+        def run_in_executor(executor, func, *args):
+            self.jobs += 1
+            return original(executor, func, *args)
+
+        loop.run_in_executor = run_in_executor
+
+
+def platform_configs(base_url, circuits):
+    """ Return configuration of all platforms using every circuit of the
+        fake controller.
+    """
+    common = {"platform": DOMAIN, "base_url": base_url, "username": "user", "password": "password"}
+    names = [{"name": f"Room {circuit_id}", "circuit": circuit_id} for circuit_id in range(circuits)]
+    return {
+        "climate": [
+            {
+                **common,
+                "circuits": [
+                    {
+                        "name": f"Room {circuit_id}",
+                        "circuit": circuit_id,
+                        "schedule": {"day_schedules": [circuit_id % 32]},
+                        "schedule_override": 31,
+                    }
+                    for circuit_id in range(circuits)
+                ],
+            }
+        ],
+        "sensor": [{**common, "circuits": names}],
+        "switch": [{**common, "circuits": names}],
+        "binary_sensor": [common],
+    }
+
+
+async def async_measure_cycle(coordinator, server, probe):
+    """ Run one update cycle of the coordinator and return its cost.
+    """
+    server.call(server.fake.reset_stats)
+    jobs = probe.jobs
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    await coordinator.async_refresh()
+    cpu = time.thread_time() - cpu
+    wall = time.perf_counter() - wall
+    stats = server.call(server.fake.stats)
+    return {
+        "requests": stats["total"],
+        "connections": stats["connections"],
+        "wall": wall,
+        "loop": cpu,
+        "executor": probe.jobs - jobs,
+    }
+
+
+async def async_run_scenario(circuits, latency, cycles, port):
+    """ Set up the platforms against a fake controller with `circuits`
+        circuits and measure `cycles` steady update cycles.
+    """
+    from homeassistant import bootstrap, loader
+    from homeassistant.core import HomeAssistant
+    from homeassistant.setup import async_setup_component
+
+    server = FakeServerThread(FakeHC64(circuits, latency), port)
+    server.start()
+    with tempfile.TemporaryDirectory() as config_dir:
+        os.makedirs(os.path.join(config_dir, "custom_components"))
+        os.symlink(COMPONENT, os.path.join(config_dir, "custom_components", DOMAIN))
+
+        hass = HomeAssistant(config_dir)
+        hass.config.skip_pip = True
+        loader.async_setup(hass)
+        await bootstrap.async_from_config_dict({"homeassistant": {}}, hass)
+        probe = ExecutorProbe(hass.loop)
+
+        setup = time.perf_counter()
+        for domain, config in platform_configs(f"http://127.0.0.1:{port}/", circuits).items():
+            await async_setup_component(hass, domain, {domain: config})
+        await hass.async_start()
+        await hass.async_block_till_done()
+        setup = time.perf_counter() - setup
+        setup_requests = server.call(server.fake.stats)["total"]
+
+        coordinator = next(iter(hass.data[DOMAIN]["coordinators"].values()))
+        # Startup refreshed everything, force a full cycle once more to
+        # measure it, then measure steady cycles.
+        coordinator._slow_refreshed.clear()
+        full = await async_measure_cycle(coordinator, server, probe)
+        steady = [await async_measure_cycle(coordinator, server, probe) for _ in range(cycles)]
+
+        await hass.async_stop()
+    server.stop()
+
+    return {
+        "circuits": circuits,
+        "latency": latency,
+        "setup": {"requests": setup_requests, "wall": setup},
+        "full": full,
+        "steady": {key: statistics.mean(cycle[key] for cycle in steady) for key in full},
+        "steady_max_wall": max(cycle["wall"] for cycle in steady),
+    }
+
+
+def print_results(results):
+    print(
+        f"{'circuits':>8} {'latency':>8} | {'setup req':>9} {'setup s':>8} | "
+        f"{'full req':>8} {'full s':>7} | {'req/cycle':>9} {'conn':>5} {'wall s':>7} {'max s':>7} {'loop ms':>8} "
+        f"{'executor':>8}"
+    )
+    for result in results:
+        full = result["full"]
+        steady = result["steady"]
+        print(
+            f"{result['circuits']:>8} {result['latency']:>8.3f} | "
+            f"{result['setup']['requests']:>9} {result['setup']['wall']:>8.2f} | "
+            f"{full['requests']:>8} {full['wall']:>7.2f} | "
+            f"{steady['requests']:>9.1f} {steady['connections']:>5.1f} {steady['wall']:>7.2f} {result['steady_max_wall']:>7.2f} "
+            f"{steady['loop'] * 1000:>8.1f} {steady['executor']:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark polling of the BMR HC64 integration")
+    parser.add_argument("--circuits", type=int, nargs="+", default=[1, 8, 32, 64], help="numbers of circuits")
+    parser.add_argument("--latency", type=float, default=0.05, help="response latency of the controller in seconds")
+    parser.add_argument("--cycles", type=int, default=5, help="number of steady cycles to measure")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    # Integrations of the default config whose requirements aren't installed
+    # fail to load, that doesn't matter here.
+    logging.getLogger("homeassistant.setup").setLevel(logging.CRITICAL)
+    logging.getLogger("homeassistant.loader").setLevel(logging.CRITICAL)
+    results = []
+    for circuits in args.circuits:
+        results.append(asyncio.run(async_run_scenario(circuits, args.latency, args.cycles, args.port)))
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        print_results(results)
+
+
+if __name__ == "__main__":
+    main()
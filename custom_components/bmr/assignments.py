@@ -0,0 +1,42 @@
+"""
+Circuit assignments (summer mode, low mode) as bit masks.
+
+The controller reports assignments as a string of "0" and "1", one per
+circuit. Circuit IDs are 0-63 so a set of circuits fits a 64-bit integer
+mask: bit N is set when circuit N is assigned. Membership, all and any checks
+are single bit operations and changes of several circuits merge into one
+mask.
+"""
+
+NUM_CIRCUITS = 64
+
+
+def to_mask(assignments):
+    """ Convert a list of booleans (as returned by the client) to a mask.
+    """
+    mask = 0
+    for circuit_id, value in enumerate(assignments):
+        if value:
+            mask |= 1 << circuit_id
+    return mask
+
+
+def from_mask(mask, length=NUM_CIRCUITS):
+    """ Convert a mask to a list of booleans of the given length.
+    """
+    return [bool(mask >> circuit_id & 1) for circuit_id in range(length)]
+
+
+def circuits_mask(circuit_ids):
+    """ Return mask of the circuits.
+    """
+    mask = 0
+    for circuit_id in circuit_ids:
+        mask |= 1 << circuit_id
+    return mask
+
+
+def mask_circuits(mask):
+    """ Return IDs of the circuits in the mask.
+    """
+    return [circuit_id for circuit_id in range(NUM_CIRCUITS) if mask >> circuit_id & 1]
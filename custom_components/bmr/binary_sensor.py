@@ -13,52 +13,53 @@ binary_sensor:
 __version__ = "0.7"
 
 import logging
-import socket
-from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.components.binary_sensor import PLATFORM_SCHEMA, BinarySensorEntity
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
-from homeassistant.util import Throttle as throttle
+from homeassistant.core import callback
 
-_LOGGER = logging.getLogger(__name__)
+from .const import CONF_BASE_URL
+from .coordinator import CONTROLLER_SCHEMA, async_get_coordinator
+from .entity import BmrEntity
 
-CONF_BASE_URL = "base_url"
+_LOGGER = logging.getLogger(__name__)
 
 PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
     {
         vol.Required(CONF_BASE_URL): cv.string,
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
+        **CONTROLLER_SCHEMA,
     }
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    import pybmr
-
-    base_url = config.get(CONF_BASE_URL)
-    user = config.get(CONF_USERNAME)
-    password = config.get(CONF_PASSWORD)
-
-    bmr = pybmr.Bmr(base_url, user, password)
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    coordinator = await async_get_coordinator(hass, config)
+    coordinator.track_hdo()
     sensors = [
-        BmrControllerHDO(bmr),
+        BmrControllerHDO(coordinator),
     ]
 
-    add_entities(sensors)
+    async_add_entities(sensors)
+    coordinator.async_schedule_refresh()
 
 
-class BmrControllerHDO(BinarySensorEntity):
-    """ Binary sensor for reporting HDO (low/high electricity tariff).
+class BmrControllerHDO(BmrEntity, BinarySensorEntity):
+    """ Binary sensor for reporting HDO (low/high electricity tariff). The
+        coordinator learns when HDO switches and reads it mostly around the
+        predicted switches, the prediction is reported in the attributes.
     """
 
-    def __init__(self, bmr):
-        self._bmr = bmr
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
         self._hdo = None
+        self._prediction = None
+        self._snapshot_keys = [("hdo",)]
 
-        self._unique_id = f"{self._bmr.getUniqueId()}-binary-sensor-hdo"
+        self._unique_id = f"{coordinator.unique_id}-binary-sensor-hdo"
 
     @property
     def name(self):
@@ -78,12 +79,18 @@ class BmrControllerHDO(BinarySensorEntity):
         """
         return bool(self._hdo)
 
-    @throttle(timedelta(seconds=30))
-    def update(self):
-        """ Fetch new state data for the sensor.
-            This is the only method that should fetch new data for Home Assistant.
+    @property
+    def extra_state_attributes(self):
+        if self._prediction is None:
+            return {"next_transition": None, "next_state": None}
+        return {"next_transition": self._prediction[0], "next_state": self._prediction[1]}
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the HDO state from the latest snapshot fetched by the
+            coordinator.
         """
-        try:
-            self._hdo = self._bmr.getHDO()
-        except socket.timeout:
-            _LOGGER.warn("Read from BMR HC64 controller timed out. Retrying later.")
+        if self.coordinator.data:
+            self._hdo = self.coordinator.data["hdo"]
+        self._prediction = self.coordinator.hdo_prediction
+        super()._handle_coordinator_update()
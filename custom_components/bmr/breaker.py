@@ -0,0 +1,106 @@
+"""
+Circuit breaker for the BMR HC64 controller.
+
+When the controller hangs every request waits for the full request timeout
+and the update cycles, HDO reads and writes queue up behind each other. The
+breaker of the controller counts consecutive requests which failed with a
+timeout or a connection error. After DEFAULT_FAILURE_THRESHOLD of them it
+opens: requests fail right away without being sent. Once the backoff passes
+a single request is let through as a probe (half-open). When the controller
+answers the breaker closes and requests flow again, otherwise it opens again
+with the backoff doubled, up to DEFAULT_MAX_BACKOFF.
+"""
+
+import time
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 3
+DEFAULT_INITIAL_BACKOFF = 30  # seconds
+DEFAULT_MAX_BACKOFF = 600  # seconds
+
+
+class BmrCircuitBreaker:
+    """ Circuit breaker of one controller. The client asks acquire() before
+        sending a request and reports the outcome with record_success(),
+        record_failure() or release().
+    """
+
+    def __init__(
+        self,
+        failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+        initial_backoff=DEFAULT_INITIAL_BACKOFF,
+        max_backoff=DEFAULT_MAX_BACKOFF,
+    ):
+        self.failure_threshold = failure_threshold
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.backoff = None
+        self._retry_at = None
+
+    @property
+    def retry_in(self):
+        """ Seconds until the next probe, None unless the breaker is open.
+        """
+        if self.state != STATE_OPEN:
+            return None
+        return max(self._retry_at - time.monotonic(), 0.0)
+
+    def available(self):
+        """ Return True if a request can be queued now, i.e. the breaker is
+            closed or the next probe is due.
+        """
+        return self.state == STATE_CLOSED or (self.state == STATE_OPEN and time.monotonic() >= self._retry_at)
+
+    def acquire(self):
+        """ Return True if a request may be sent now. The first request after
+            the backoff is the probe, no other request is sent until it
+            finishes.
+        """
+        if self.state == STATE_CLOSED:
+            return True
+        if self.state == STATE_OPEN and time.monotonic() >= self._retry_at:
+            self.state = STATE_HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        """ The controller answered. Return True if the breaker closed.
+        """
+        recovered = self.state != STATE_CLOSED
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.backoff = None
+        self._retry_at = None
+        return recovered
+
+    def record_failure(self):
+        """ The request timed out or couldn't connect. Return True if the
+            breaker opened.
+        """
+        self.failures += 1
+        if self.state == STATE_HALF_OPEN:
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+        elif self.state == STATE_CLOSED and self.failures >= self.failure_threshold:
+            self.backoff = self.initial_backoff
+        else:
+            return False
+        self.state = STATE_OPEN
+        self._retry_at = time.monotonic() + self.backoff
+        return True
+
+    def release(self):
+        """ The request ended without telling anything about the controller
+            (e.g. it was cancelled). A probe can be sent again right away.
+        """
+        if self.state == STATE_HALF_OPEN:
+            self.state = STATE_OPEN
+            self._retry_at = time.monotonic()
+
+    def as_dict(self):
+        return {"state": self.state, "failures": self.failures, "backoff": self.backoff, "retry_in": self.retry_in}
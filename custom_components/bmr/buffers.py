@@ -0,0 +1,53 @@
+"""
+Fixed-size ring buffers backed by `array`.
+"""
+
+from array import array
+
+
+class RingBuffer:
+    """ Ring buffer of floats with a fixed capacity. Appending is O(1) and
+        the memory used doesn't grow, the oldest values are overwritten.
+    """
+
+    def __init__(self, capacity, typecode="d"):
+        self._data = array(typecode, [0] * capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    def append(self, value):
+        """ Append the value, overwrite the oldest one if the buffer is full.
+        """
+        end = (self._start + self._size) % self._capacity
+        self._data[end] = value
+        if self._size < self._capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self._capacity
+
+    def last(self):
+        """ Return the most recently appended value.
+        """
+        if not self._size:
+            raise IndexError("Ring buffer is empty")
+        return self._data[(self._start + self._size - 1) % self._capacity]
+
+    def values(self):
+        """ Return the values from the oldest to the newest.
+        """
+        end = self._start + self._size
+        if end <= self._capacity:
+            return self._data[self._start : end]
+        return self._data[self._start :] + self._data[: end - self._capacity]
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
@@ -0,0 +1,624 @@
+"""
+Asyncio client for the BMR HC64 controller.
+
+This is a port of the pybmr library to aiohttp. The method names and return
+values are the same as in pybmr, but all calls are coroutines so no executor
+thread is tied up while the (very slow) controller answers.
+"""
+
+import asyncio
+import logging
+import re
+from datetime import date, datetime
+from hashlib import sha256
+from urllib.parse import urljoin
+
+import aiohttp
+
+from .breaker import BmrCircuitBreaker
+from .metrics import BmrMetrics
+from .scheduler import PRIORITY_USER, BmrRequestScheduler
+
+_LOGGER = logging.getLogger(__name__)
+
+HTTP_DEFAULT_TIMEOUT = 10  # seconds
+
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded; charset=UTF-8"}
+
+# Names of the operations the endpoints are recorded under in the metrics.
+OPERATIONS = {
+    "/menu.html": "authenticate",
+    "/numOfRooms": "getNumCircuits",
+    "/listOfRooms": "getCircuitNames",
+    "/wholeRoom": "getCircuit",
+    "/listOfModes": "getSchedules",
+    "/loadMode": "getSchedule",
+    "/saveMode": "setSchedule",
+    "/loadSummerMode": "getSummerMode",
+    "/saveSummerMode": "setSummerMode",
+    "/letoLoadRooms": "getSummerModeAssignments",
+    "/letoSaveRooms": "saveSummerModeAssignments",
+    "/loadLows": "getLowMode",
+    "/lowSave": "setLowMode",
+    "/lowLoadRooms": "getLowModeAssignments",
+    "/lowSaveRooms": "saveLowModeAssignments",
+    "/roomSettings": "getCircuitSchedules",
+    "/saveAssignmentModes": "setCircuitSchedules",
+    "/loadHDO": "getHDO",
+    "/numOfRollerShutters": "getNumOfRollerShutters",
+    "/listOfRollerShutters": "getListOfRollerShutters",
+    "/wholeRollerShutter": "getWholeRollerShutter",
+    "/saveManualChange": "saveManualChange",
+}
+
+# Positions of roller shutters as used by the controller -> position in
+# percent (100 is fully open, 0 fully closed). The controller can move a
+# shutter only to one of these.
+SHUTTER_POSITIONS = {
+    0: 100,  # open (fully pulled up)
+    3: 50,  # half
+    2: 25,  # slits (3/4 down)
+    1: 0,  # closed (fully lowered down)
+}
+
+# Tilt of the slats is set in steps 0 (open, horizontal) to 10 (closed,
+# vertical).
+SHUTTER_TILT_STEPS = 10
+
+
+# Signs of the login page, which the controller returns instead of data when
+# it doesn't remember our login.
+LOGIN_PAGE = re.compile(r"<html|loginName", re.IGNORECASE)
+
+
+class BmrError(Exception):
+    """ The controller returned an error or malformed data.
+    """
+
+
+class BmrLoginRequired(BmrError):
+    """ The controller rejected the request, we need to log in again.
+    """
+
+
+class BmrUnavailable(BmrError):
+    """ The controller doesn't respond, the request wasn't sent (see
+        BmrCircuitBreaker).
+    """
+
+
+class BmrClient:
+    """ Client for the HTTP API of the BMR HC64 controller. All requests go
+        through the request scheduler of the controller.
+
+        The controller remembers the logged-in user (by IP address), so the
+        client logs in once and then only when the controller rejects a
+        request. Pass a session dedicated to the controller to keep its
+        connections alive between requests.
+
+        Requests of a controller which stopped responding fail with
+        BmrUnavailable without being sent, see BmrCircuitBreaker.
+    """
+
+    def __init__(self, session, base_url, user, password, timeout=HTTP_DEFAULT_TIMEOUT, scheduler=None):
+        self.scheduler = scheduler or BmrRequestScheduler()
+        self.breaker = BmrCircuitBreaker()
+        self.metrics = BmrMetrics()
+        self._session = session
+        self._base_url = base_url
+        self._user = user
+        self._password = password
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+
+        self._unique_id = None
+        self._logged_in = False
+        self._login_lock = asyncio.Lock()
+
+    def set_timeout(self, timeout):
+        """ Set timeout of a single request in seconds.
+        """
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async def _post(self, path, data):
+        """ Send a POST request to the controller and return the response
+            body.
+        """
+        try:
+            return await self._post_once(path, data)
+        except aiohttp.ServerDisconnectedError:
+            # The controller closed a kept-alive connection which has been
+            # idle for a while, retry on a new one.
+            return await self._post_once(path, data)
+
+    async def _post_once(self, path, data):
+        async with self._session.post(
+            urljoin(self._base_url, path), data=data, headers=FORM_HEADERS, timeout=self._timeout
+        ) as response:
+            body = await response.read()
+            if response.status in (401, 403):
+                raise BmrLoginRequired("Server returned status code {}".format(response.status))
+            if response.status != 200:
+                raise BmrError("Server returned status code {}".format(response.status))
+            text = body.decode(response.charset or "iso-8859-1", errors="replace")
+            if LOGIN_PAGE.search(text):
+                raise BmrLoginRequired("Server returned the login page")
+            return text
+
+    async def _authenticate(self):
+        """ Login to BMR controller. Note that BMR controller is using a kinda
+            weird and insecure authentication mechanism - it looks like it's
+            just remembering the username and IP address of the logged-in user.
+        """
+
+        def bmr_hash(value):
+            day = date.today().day
+            return "".join(hex(ord(c) ^ (day << 2))[2:].zfill(2) for c in value).upper()
+
+        data = {"loginName": bmr_hash(self._user), "passwd": bmr_hash(self._password)}
+        async with self._session.post(
+            urljoin(self._base_url, "/menu.html"), data=data, timeout=self._timeout
+        ) as response:
+            text = await response.text(errors="replace")
+        if "res_error_title" in text:
+            raise BmrError("Authentication failed, check username/password")
+
+    async def _login(self):
+        """ Log in unless we are logged in already. Concurrent requests wait
+            for the same login.
+        """
+        async with self._login_lock:
+            if not self._logged_in:
+                with self.metrics.measure(OPERATIONS["/menu.html"]):
+                    await self._authenticate()
+                self._logged_in = True
+
+    async def _request(self, path, data, write=False):
+        """ Make sure we are logged-in and call the BMR API endpoint. When the
+            controller rejects the request log in again and retry once. Writes
+            always run with the user priority, identical reads waiting in the
+            queue are merged.
+        """
+
+        async def send():
+            await self._login()
+            try:
+                with self.metrics.measure(OPERATIONS.get(path, path)):
+                    return await self._post(path, data)
+            except BmrLoginRequired:
+                self._logged_in = False
+            await self._login()
+            with self.metrics.measure(OPERATIONS.get(path, path)):
+                return await self._post(path, data)
+
+        async def request():
+            # Checked again when the request gets its turn, the breaker may
+            # have opened while it was queued.
+            if not self.breaker.acquire():
+                raise self._unavailable()
+            try:
+                result = await send()
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                if self.breaker.record_failure():
+                    _LOGGER.warning(
+                        "BMR HC64 controller %s isn't responding, pausing requests for %d seconds.",
+                        self._base_url,
+                        self.breaker.backoff,
+                    )
+                raise
+            except BmrError:
+                # The controller answered, even if with garbage.
+                self._record_success()
+                raise
+            except BaseException:
+                self.breaker.release()
+                raise
+            self._record_success()
+            return result
+
+        if not self.breaker.available():
+            raise self._unavailable()
+        if write:
+            return await self.scheduler.async_run(request, priority=PRIORITY_USER)
+        key = (path, tuple(sorted(data.items())) if isinstance(data, dict) else data)
+        return await self.scheduler.async_run(request, key=key)
+
+    def _record_success(self):
+        if self.breaker.record_success():
+            _LOGGER.info("BMR HC64 controller %s is responding again.", self._base_url)
+
+    def _unavailable(self):
+        retry_in = self.breaker.retry_in
+        if retry_in is None:
+            return BmrUnavailable(f"Controller {self._base_url} isn't responding, waiting for a probe request")
+        return BmrUnavailable(f"Controller {self._base_url} isn't responding, next try in {retry_in:.0f} seconds")
+
+    async def getUniqueId(self):
+        """ Return unique ID of the controller.
+
+            The BMR HC64 API doesn't provide anything that could be used as a
+            unique ID, such as serial number. Therefore we have to generate it
+            from something that doesn't usually change - such as circuit names.
+        """
+        if self._unique_id is None:
+            names = await self.getCircuitNames()
+            self._unique_id = sha256(b"\0".join([name.encode("utf-8") for name in names])).hexdigest()[:8]
+        return self._unique_id
+
+    async def getNumCircuits(self):
+        """ Get the number of heating circuits.
+        """
+        return int(await self._request("/numOfRooms", {"param": "+"}))
+
+    async def getCircuitNames(self):
+        """ Get the names of all heating circuits.
+        """
+        text = await self._request("/listOfRooms", {"param": "+"})
+        return [text[i : i + 13].strip() for i in range(0, len(text), 13)]
+
+    async def getCircuit(self, circuit_id):
+        """ Get circuit status.
+        """
+        return parse_circuit(circuit_id, await self._request("/wholeRoom", {"param": str(circuit_id)}))
+
+    async def getSchedules(self):
+        """ Load schedule names.
+        """
+        text = await self._request("/listOfModes", {"param": "+"})
+        return [x.rstrip() for x in re.findall(r".{13}", text)]
+
+    async def getSchedule(self, schedule_id):
+        """ Load schedule settings.
+        """
+        return parse_schedule(schedule_id, await self._request("/loadMode", {"modeID": "{:02d}".format(schedule_id)}))
+
+    async def setSchedule(self, schedule_id, name, timetable):
+        """ Save schedule settings. Note that the first entry in the timetable
+            must be always for time "00:00".
+        """
+        if timetable[0]["time"] != "00:00":
+            raise BmrError("First timetable entry must be for time 00:00")
+        data = {
+            "modeSettings": "{:02d}{:13.13}{}".format(
+                schedule_id,
+                name[:13],
+                "".join(["{}{:03d}".format(item["time"], int(item["temperature"])) for item in timetable]),
+            )
+        }
+        return "true" in await self._request("/saveMode", data, write=True)
+
+    async def getSummerMode(self):
+        """ Return True if summer mode is currently activated.
+        """
+        return await self._request("/loadSummerMode", "param=+") == "0"
+
+    async def setSummerMode(self, value):
+        """ Enable or disable summer mode.
+        """
+        return "true" in await self._request("/saveSummerMode", {"summerMode": "0" if value else "1"}, write=True)
+
+    async def getSummerModeAssignments(self):
+        """ Load circuit summer mode assignments, i.e. which circuits will be
+            affected by summer mode when it is turned on.
+        """
+        return parse_assignments(await self._request("/letoLoadRooms", {"param": "+"}))
+
+    async def setSummerModeAssignments(self, circuits, value):
+        """ Assign or remove specified circuits to/from summer mode. Leave
+            other circuits as they are.
+        """
+        assignments = list(await self.getSummerModeAssignments())
+        for circuit_id in circuits:
+            assignments[circuit_id] = value
+        return await self.saveSummerModeAssignments(assignments)
+
+    async def saveSummerModeAssignments(self, assignments):
+        """ Save summer mode assignments of all circuits at once.
+        """
+        data = {"value": "".join([str(int(x)) for x in assignments])}
+        return "true" in await self._request("/letoSaveRooms", data, write=True)
+
+    async def getLowMode(self):
+        """ Get status of the LOW mode.
+        """
+        return parse_low_mode(await self._request("/loadLows", {"param": "+"}))
+
+    async def setLowMode(self, enabled, temperature=None, start_datetime=None, end_datetime=None):
+        """ Enable or disable LOW mode. Temperature specifies the desired
+            temperature for the LOW mode.
+        """
+        if start_datetime is None:
+            start_datetime = datetime.now()
+        if temperature is None:
+            temperature = (await self.getLowMode())["temperature"]
+        data = {
+            "lowData": "{:03d}{}{}".format(
+                int(temperature),
+                start_datetime.strftime("%Y-%m-%d%H:%M") if enabled and start_datetime else " " * 15,
+                end_datetime.strftime("%Y-%m-%d%H:%M") if enabled and end_datetime else " " * 15,
+            )
+        }
+        return "true" in await self._request("/lowSave", data, write=True)
+
+    async def getLowModeAssignments(self):
+        """ Load circuit LOW mode assignments, i.e. which circuits will be
+            affected by LOW mode when it is turned on.
+        """
+        return parse_assignments(await self._request("/lowLoadRooms", {"param": "+"}))
+
+    async def setLowModeAssignments(self, circuits, value):
+        """ Assign or remove specified circuits to/from LOW mode. Leave other
+            circuits as they are.
+        """
+        assignments = list(await self.getLowModeAssignments())
+        for circuit_id in circuits:
+            assignments[circuit_id] = value
+        return await self.saveLowModeAssignments(assignments)
+
+    async def saveLowModeAssignments(self, assignments):
+        """ Save LOW mode assignments of all circuits at once.
+        """
+        data = {"value": "".join([str(int(x)) for x in assignments])}
+        return "true" in await self._request("/lowSaveRooms", data, write=True)
+
+    async def getCircuitSchedules(self, circuit_id):
+        """ Load circuit schedule assignments, i.e. which schedule is assigned
+            to what day. It is possible to set different schedule for up 21
+            days.
+        """
+        text = await self._request("/roomSettings", {"roomID": "{:02d}".format(circuit_id)})
+        return parse_circuit_schedules(text)
+
+    async def setCircuitSchedules(self, circuit_id, day_schedules, starting_day=1):
+        """ Assign circuit schedules. It is possible to have a different
+            schedule for up to 21 days.
+        """
+        day_schedules = list(day_schedules) + [None for _ in range(21 - len(day_schedules))]
+        for idx in range(len(day_schedules) - 1):
+            if day_schedules[idx] is None and day_schedules[idx + 1] is not None:
+                raise BmrError("Circuit schedules can't have any undefined gaps.")
+        data = {
+            "roomSettings": "{:02d}{:02d}{}".format(
+                circuit_id, starting_day, "".join(["{:02d}".format(x if x is not None else -1) for x in day_schedules]),
+            )
+        }
+        return "true" in await self._request("/saveAssignmentModes", data, write=True)
+
+    async def getHDO(self):
+        """ Return True if the low electricity tariff (HDO) is active.
+        """
+        return await self._request("/loadHDO", "param=+") == "1"
+
+    async def getNumOfRollerShutters(self):
+        """ Get the number of installed roller shutters.
+        """
+        return int(await self._request("/numOfRollerShutters", {"param": "+"}))
+
+    async def getListOfRollerShutters(self):
+        """ Get the names of installed roller shutters.
+        """
+        text = await self._request("/listOfRollerShutters", {"param": "+"})
+        return [text[i : i + 13].strip() for i in range(0, len(text), 13)]
+
+    async def getWholeRollerShutter(self, shutter_id):
+        """ Get status of the roller shutter.
+        """
+        text = await self._request("/wholeRollerShutter", {"rollerShutter": str(shutter_id)})
+        return parse_roller_shutter(shutter_id, text)
+
+    async def saveManualChange(self, shutter_id, pos, tilt):
+        """ Move the roller shutter. Position and tilt are in percent (100 is
+            fully open), the controller moves the shutter to the nearest
+            position it supports, see bmr_shutter_position().
+        """
+        data = {
+            "manualChange": "{:02d}{:01d}{:02d}".format(shutter_id, bmr_shutter_position(pos), bmr_shutter_tilt(tilt))
+        }
+        return "true" in await self._request("/saveManualChange", data, write=True)
+
+
+def bmr_shutter_position(position):
+    """ Convert position in percent to the nearest position supported by the
+        controller (see SHUTTER_POSITIONS).
+    """
+    if position > 90:
+        return 0
+    if position > 45:
+        return 3
+    if position > 15:
+        return 2
+    return 1
+
+
+def bmr_shutter_tilt(tilt):
+    """ Convert tilt in percent (100 is open) to the tilt step of the
+        controller.
+    """
+    return round((100 - tilt) * SHUTTER_TILT_STEPS / 100)
+
+
+def parse_circuit(circuit_id, text):
+    """ Parse the response of the /wholeRoom endpoint.
+
+        Raw data returned from server:
+
+          1Pokoj 202 v  021.7+12012.0000.000.0000000000
+    """
+    match = re.match(
+        r"""
+            (?P<enabled>.{1})                  # Whether the circuit is enabled
+            (?P<name>.{13})                    # Name of the circuit
+            (?P<temperature>.{5})              # Current temperature
+            (?P<target_temperature_str>.{3})   # Target temperature (string)
+            (?P<target_temperature>.{5})       # Target temperature (float)
+            (?P<user_offset>.{5})              # Current temperature offset set by user
+            (?P<max_offset>.{4})               # Max temperature offset
+            (?P<heating>.{1})                  # Whether the circuit is currently heating
+            (?P<window_heating>.{1})
+            (?P<card>.{1})
+            (?P<warning>.{3})                  # Warning code
+            (?P<low_mode>.{1})                 # Whether the circuit is assigned to low mode and low mode is active
+            (?P<summer_mode>.{1})              # Whether the circuit is assigned to summer mode and summer mode
+                                               # is active
+            (?P<cooling>.{1})                  # Whether the circuit is cooling (only water-based circuits)
+        """,
+        text,
+        re.VERBOSE,
+    )
+    if not match:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+    room_status = match.groupdict()
+
+    # Sometimes some of the values are malformed, i.e. "00\x00\x00\x00" or "-1-1-"
+    result = {
+        "id": circuit_id,
+        "enabled": bool(int(room_status["enabled"])),
+        "name": room_status["name"].rstrip(),
+        "temperature": None,
+        "target_temperature": None,
+        "user_offset": None,
+        "max_offset": None,
+        "heating": False,
+        "warning": 0,
+        "cooling": False,
+        "low_mode": False,
+        "summer_mode": False,
+    }
+    for key in ("temperature", "heating", "cooling", "warning", "low_mode", "summer_mode", "user_offset", "max_offset"):
+        try:
+            result[key] = float(room_status[key])
+        except ValueError:
+            pass
+
+    # If summer mode is turned on (which means the system is powered down)
+    # return target temperature as `None`, not 0 degrees. Also ignore target
+    # temperature of 0 degrees, that is most likely a nonsense reported when
+    # the heating controller is reloading configuration.
+    try:
+        if not bool(int(room_status["summer_mode"])):
+            result["target_temperature"] = float(room_status["target_temperature"]) or None
+    except ValueError:
+        pass
+
+    return result
+
+
+def parse_schedule(schedule_id, text):
+    """ Parse the response of the /loadMode endpoint.
+
+        Example: 1 Byt        00:0002106:0002112:0002121:00021
+    """
+    match = re.match(
+        r"""
+            (?P<name>.{13})                          # schedule name
+            (?P<timetable>(\d{2}:\d{2}\d{3}){1,8})?  # time and target temperature
+        """,
+        text,
+        re.VERBOSE,
+    )
+    if not match:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+    schedule = match.groupdict()
+    timetable = None
+    if schedule["timetable"]:
+        timetable = [
+            {"time": x[0], "temperature": int(x[1])} for x in re.findall(r"(\d{2}:\d{2})(\d{3})", schedule["timetable"])
+        ]
+    return {"id": schedule_id, "name": schedule["name"].rstrip(), "timetable": timetable}
+
+
+def parse_assignments(text):
+    """ Parse summer/low mode circuit assignments, e.g. "0011000...".
+    """
+    try:
+        return [bool(int(x)) for x in text]
+    except ValueError:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+
+
+def parse_low_mode(text):
+    """ Parse the response of the /loadLows endpoint. The response is
+        formatted as "<temperature><start_datetime><end_datetime>".
+    """
+    match = re.match(
+        r"""
+        (?P<temperature>\d{3})
+        (?P<start_datetime>\d{4}-\d{2}-\d{2}\d{2}:\d{2})?
+        (?P<end_datetime>\d{4}-\d{2}-\d{2}\d{2}:\d{2})?
+        """,
+        text,
+        re.VERBOSE,
+    )
+    if not match:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+    low_mode = match.groupdict()
+    result = {
+        "enabled": low_mode["start_datetime"] is not None,
+        "temperature": int(low_mode["temperature"]),
+    }
+    if low_mode["start_datetime"]:
+        result["start_date"] = datetime.strptime(low_mode["start_datetime"], "%Y-%m-%d%H:%M")
+    if low_mode["end_datetime"]:
+        result["end_date"] = datetime.strptime(low_mode["end_datetime"], "%Y-%m-%d%H:%M")
+    return result
+
+
+def parse_circuit_schedules(text):
+    """ Parse the response of the /roomSettings endpoint.
+
+        Example: 0140-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1-1
+    """
+    match = re.match(
+        r"""
+            (?P<starting_day>\d{2})            # Which schedule should be the first to start with
+            (?P<day_schedules>([-\d]{2}){21})  # schedule IDs + indicator of the currently active schedule
+        """,
+        text,
+        re.VERBOSE,
+    )
+    if not match:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+    circuit_schedules = match.groupdict()
+    result = {
+        "starting_day": int(circuit_schedules["starting_day"]),
+        "current_day": None,
+        "day_schedules": [],
+    }
+    for idx, schedule_id in enumerate(re.findall(r"[-\d]{2}", circuit_schedules["day_schedules"])):
+        schedule_id = int(schedule_id)
+        if schedule_id == -1:
+            # The list of schedules must be continuous, there can't be any
+            # gaps. So this is the last entry.
+            break
+        # Schedule ID is in the lower 5 bits, the 6th rightmost bit indicates
+        # the currently active schedule.
+        result["day_schedules"].append(schedule_id & 0b00011111)
+        if schedule_id & 0b00100000 == 0b00100000:
+            result["current_day"] = idx + 1
+    return result
+
+
+def parse_roller_shutter(shutter_id, text):
+    """ Parse the response of the /wholeRollerShutter endpoint.
+
+        Example: 1Kuchyna      0000010000000000000
+    """
+    match = re.match(
+        r"""
+            (?P<enabled>.{1})                  # Whether the shutter is enabled
+            (?P<name>.{13})                    # Name of the shutter
+            (?P<pos>\d{1})                     # Position (see SHUTTER_POSITIONS)
+            (?P<tilt>\d{2})                    # Tilt step (0 open - 10 closed)
+        """,
+        text,
+        re.VERBOSE,
+    )
+    if not match:
+        raise BmrError("Server returned malformed data: {}. Try again later".format(text))
+    shutter = match.groupdict()
+    return {
+        "id": shutter_id,
+        "enabled": shutter["enabled"] == "1",
+        "name": shutter["name"].rstrip(),
+        "pos": int(shutter["pos"]),
+        "tilt": int(shutter["tilt"]),
+    }
@@ -20,13 +20,14 @@ configuration.yaml
           schedule_override: 16
           min_temperature: 20
           max_temperature: 24
+          preheat: true
 """
 
 __version__ = "0.7"
 
-import logging
-import socket
+import asyncio
 from datetime import timedelta
+import logging
 
 import voluptuous as vol
 
@@ -44,8 +45,16 @@ from homeassistant.const import (
     CONF_USERNAME,
     UnitOfTemperature,
 )
+from homeassistant.core import callback
 import homeassistant.helpers.config_validation as cv
-from homeassistant.util import Throttle as throttle
+from homeassistant.helpers.restore_state import RestoreEntity
+from homeassistant.util import dt as dt_util
+
+from .const import CONF_BASE_URL, CONF_DISCOVER_CIRCUITS, TEMPERATURE_DEBOUNCE
+from .coordinator import CONTROLLER_SCHEMA, BmrControllerState, async_get_coordinator
+from .entity import BmrEntity
+from .thermal import MAX_PREHEAT_LEAD
+from .writer import BmrDebouncedWrite
 
 PRESET_NORMAL = "Normal"
 PRESET_AWAY = "Away"
@@ -55,7 +64,6 @@ _LOGGER = logging.getLogger(__name__)
 TEMP_MIN = 7.0
 TEMP_MAX = 35.0
 
-CONF_BASE_URL = "base_url"
 CONF_CIRCUITS = "circuits"
 CONF_NAME = "name"
 CONF_CIRCUIT_ID = "circuit"
@@ -66,7 +74,10 @@ CONF_SCHEDULE_OVERRIDE = "schedule_override"
 CONF_AWAY_TEMPERATURE = "away_temperature"
 CONF_CAN_COOL = "can_cool"
 CONF_MIN_TEMPERATURE = "min_temperature"
+CONF_TEMPERATURE_DEBOUNCE = "temperature_debounce"
 CONF_MAX_TEMPERATURE = "max_temperature"
+CONF_OVERRIDE_SCHEDULES = "override_schedules"
+CONF_PREHEAT = "preheat"
 
 CONF_CIRCUIT = vol.Schema(
     {
@@ -83,6 +94,7 @@ CONF_CIRCUIT = vol.Schema(
         vol.Required(CONF_SCHEDULE_OVERRIDE): vol.All(vol.Coerce(int), vol.Range(min=0, max=63)),
         vol.Optional(CONF_MIN_TEMPERATURE): vol.All(vol.Coerce(int), vol.Range(min=TEMP_MIN, max=TEMP_MAX)),
         vol.Optional(CONF_MAX_TEMPERATURE): vol.All(vol.Coerce(int), vol.Range(min=TEMP_MIN, max=TEMP_MAX)),
+        vol.Optional(CONF_PREHEAT): cv.boolean,
     }
 )
 
@@ -91,38 +103,96 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Required(CONF_BASE_URL): cv.string,
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
+        **CONTROLLER_SCHEMA,
         vol.Optional(CONF_AWAY_TEMPERATURE): vol.All(vol.Coerce(int), vol.Range(min=TEMP_MIN, max=TEMP_MAX)),
         vol.Optional(CONF_CAN_COOL): vol.Coerce(bool),
         vol.Optional(CONF_MIN_TEMPERATURE): vol.All(vol.Coerce(int), vol.Range(min=TEMP_MIN, max=TEMP_MAX)),
         vol.Optional(CONF_MAX_TEMPERATURE): vol.All(vol.Coerce(int), vol.Range(min=TEMP_MIN, max=TEMP_MAX)),
-        vol.Required(CONF_CIRCUITS): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
+        vol.Optional(CONF_TEMPERATURE_DEBOUNCE, default=TEMPERATURE_DEBOUNCE): cv.time_period,
+        vol.Optional(CONF_DISCOVER_CIRCUITS, default=False): cv.boolean,
+        vol.Optional(CONF_PREHEAT, default=False): cv.boolean,
+        vol.Optional(CONF_OVERRIDE_SCHEDULES, default=[]): vol.All(
+            cv.ensure_list, [vol.All(vol.Coerce(int), vol.Range(min=0, max=63))]
+        ),
+        vol.Optional(CONF_CIRCUITS, default=[]): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
     }
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    import pybmr
-
-    base_url = config.get(CONF_BASE_URL)
-    user = config.get(CONF_USERNAME)
-    password = config.get(CONF_PASSWORD)
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    coordinator = await async_get_coordinator(hass, config)
+    coordinator.track_controller_state()
+    circuits = list(config.get(CONF_CIRCUITS))
+    if config.get(CONF_DISCOVER_CIRCUITS):
+        circuits += _discovered_circuits(config, await coordinator.async_discover_circuits())
+    for circuit_config in circuits:
+        if circuit_config.get(CONF_PREHEAT, config.get(CONF_PREHEAT)):
+            coordinator.track_preheat(
+                circuit_config.get(CONF_CIRCUIT_ID), circuit_config.get(CONF_SCHEDULE)[CONF_DAY_SCHEDULES]
+            )
+        else:
+            coordinator.track_circuit(circuit_config.get(CONF_CIRCUIT_ID), schedules=True)
 
-    bmr = pybmr.Bmr(base_url, user, password)
     entities = [
         BmrRoomClimate(
-            bmr=bmr,
+            coordinator=coordinator,
             config=circuit_config,
             away_temperature=config.get(CONF_AWAY_TEMPERATURE, TEMP_MIN),
             can_cool=config.get(CONF_CAN_COOL, False),
             min_temperature=config.get(CONF_MIN_TEMPERATURE),
             max_temperature=config.get(CONF_MAX_TEMPERATURE),
+            temperature_debounce=config.get(CONF_TEMPERATURE_DEBOUNCE),
+            preheat=circuit_config.get(CONF_PREHEAT, config.get(CONF_PREHEAT)),
         )
-        for circuit_config in config.get(CONF_CIRCUITS)
+        for circuit_config in circuits
     ]
-    add_entities(entities)
+    async_add_entities(entities)
+    coordinator.async_schedule_refresh()
+
+
+def _discovered_circuits(config, discovered):
+    """ Return configuration of discovered circuits which aren't configured
+        explicitly. Every circuit needs its own override schedule, these are
+        taken from `override_schedules` in the order of circuit IDs.
+    """
+    configured = {x.get(CONF_CIRCUIT_ID) for x in config.get(CONF_CIRCUITS)}
+    used = {x.get(CONF_SCHEDULE_OVERRIDE) for x in config.get(CONF_CIRCUITS)}
+    available = [x for x in config.get(CONF_OVERRIDE_SCHEDULES) if x not in used]
+    overrides = used | set(config.get(CONF_OVERRIDE_SCHEDULES))
+    circuits = []
+    for circuit in discovered:
+        if circuit["circuit"] in configured:
+            continue
+        if set(circuit["day_schedules"]) & set(overrides):
+            _LOGGER.warning(
+                "Circuit %d (%s) uses an override schedule, configure its schedules explicitly.",
+                circuit["circuit"],
+                circuit["name"],
+            )
+            continue
+        if not available:
+            _LOGGER.warning(
+                "No override schedule left for circuit %d (%s), add more to %s.",
+                circuit["circuit"],
+                circuit["name"],
+                CONF_OVERRIDE_SCHEDULES,
+            )
+            continue
+        circuits.append(
+            {
+                CONF_NAME: circuit["name"],
+                CONF_CIRCUIT_ID: circuit["circuit"],
+                CONF_SCHEDULE: {
+                    CONF_DAY_SCHEDULES: circuit["day_schedules"],
+                    CONF_STARTING_DAY: circuit["starting_day"],
+                },
+                CONF_SCHEDULE_OVERRIDE: available.pop(0),
+            }
+        )
+    return circuits
 
 
-class BmrRoomClimate(ClimateEntity):
+class BmrRoomClimate(BmrEntity, ClimateEntity, RestoreEntity):
     """ Entity representing a room heated by the BMR HC64 controller unit.
 
         Usually the room has two temperature sensors (circuits): floor and room
@@ -163,26 +233,61 @@ class BmrRoomClimate(ClimateEntity):
           NOTE #2: The HC64 controller is slow AF so updates after changing
           something (such as HVAC mode) may take a while to show in Home
           Assistant UI. Even several minutes.
+
+        With preheating enabled the entity starts heating early enough for
+        the room to reach the next (higher) setpoint of its schedule in time,
+        instead of when the setpoint starts. The coordinator fits a thermal
+        model of the circuit (see thermal.py) every cycle, the entity
+        predicts the start of heating from it. Preheating overrides the
+        target temperature with the upcoming setpoint (i.e. switches to
+        HVAC_MODE_HEAT) and switches back to HVAC_MODE_AUTO once the setpoint
+        starts. Changing the HVAC mode or target temperature meanwhile
+        cancels it.
       """
 
     def __init__(
-        self, bmr, config, away_temperature=18.0, can_cool=False, min_temperature=TEMP_MIN, max_temperature=TEMP_MAX
+        self,
+        coordinator,
+        config,
+        away_temperature=18.0,
+        can_cool=False,
+        min_temperature=TEMP_MIN,
+        max_temperature=TEMP_MAX,
+        temperature_debounce=TEMPERATURE_DEBOUNCE,
+        preheat=False,
     ):
-        self._bmr = bmr
+        super().__init__(coordinator)
+        self._writer = coordinator.writer
+        self._temperature_write = BmrDebouncedWrite(
+            coordinator.hass,
+            temperature_debounce.total_seconds(),
+            self._async_write_temperature,
+            self._async_withdraw_temperature,
+        )
         self._config = config
+        circuit_id = config.get(CONF_CIRCUIT_ID)
+        # Preheating depends on the time and the thermal model, not only on
+        # the snapshot.
+        if not preheat:
+            self._snapshot_keys = [("circuit", circuit_id), ("schedules", circuit_id), ("controller",)]
         self._away_temperature = away_temperature
         self._can_cool = can_cool
         self._min_temperature = min_temperature
         self._max_temperature = max_temperature
 
-        self._unique_id = f"{self._bmr.getUniqueId()}-climate-{self._config.get(CONF_CIRCUIT_ID)}"
+        self._unique_id = f"{coordinator.unique_id}-climate-{self._config.get(CONF_CIRCUIT_ID)}"
 
         # Initial state
         self._circuit = {}
         self._schedule = {}
-        self._low_mode = {}
-        self._summer_mode = None
-        self._summer_mode_assignments = []
+        self._controller = BmrControllerState()
+
+        # Preheating: the planned start, (setpoint time, temperature) while
+        # preheating and the writes which started or ended it
+        self._preheat = preheat
+        self._preheat_start = None
+        self._preheating = None
+        self._preheat_write = None
 
     @property
     def name(self):
@@ -210,8 +315,11 @@ class BmrRoomClimate(ClimateEntity):
 
     @property
     def target_temperature(self):
-        """ Currently set target temperature.
+        """ Currently set target temperature. While a new target temperature
+            waits to be written show the new one.
         """
+        if self._temperature_write.pending:
+            return self._temperature_write.value
         return self._circuit.get("target_temperature")
 
     @property
@@ -249,11 +357,7 @@ class BmrRoomClimate(ClimateEntity):
             Return HVAC_MODE_AUTO if the controller is managing everything
             automatically according to its configuration.
         """
-        if (
-            self._summer_mode
-            and self._summer_mode_assignments
-            and self._summer_mode_assignments[self._config.get(CONF_CIRCUIT_ID)]
-        ):
+        if self._controller.is_circuit_off(self._config.get(CONF_CIRCUIT_ID)):
             return HVACMode.OFF
         elif [self._config.get(CONF_SCHEDULE_OVERRIDE)] == self._schedule.get("day_schedules"):
             if self._can_cool:
@@ -265,15 +369,22 @@ class BmrRoomClimate(ClimateEntity):
             # configured schedules.
             return HVACMode.AUTO
 
-    def set_hvac_mode(self, hvac_mode):
+    async def async_set_hvac_mode(self, hvac_mode):
         """ Set HVAC mode.
         """
+        await self._async_queue_hvac_mode(hvac_mode)
+
+    def _async_queue_hvac_mode(self, hvac_mode):
+        """ Queue the controller writes needed for switching to the HVAC mode.
+            The writes are coalesced with writes of other entities, return
+            future resolved once the writes are done.
+        """
         if hvac_mode == HVACMode.OFF:
             # Turn on the HVAC_MODE_OFF. This will turn off the heating/cooling
             # of the given circuit. This works by:
             #
             # - Adding the circuit to summer mode
-            # - Turning the summer mode ON
+            # - Turning the summer mode ON (done by the write batcher)
             #
             # NOTE: Sometimes (usually) there are also other circuits assigned
             # to summer mode, especially if this plugin is used for the first
@@ -281,24 +392,21 @@ class BmrRoomClimate(ClimateEntity):
             # and summer mode is turned on they will be turned off too. Make
             # sure to remove any circuits from the summer mode manually when
             # using the plugin for the first time.
-            self._bmr.setSummerModeAssignments([self._config.get(CONF_CIRCUIT_ID)], True)
-            self._bmr.setSummerMode(True)
+            self._writer.async_set_summer_mode_assignments([self._config.get(CONF_CIRCUIT_ID)], True)
         else:
             # Turn HVAC_MODE_OFF off and restore normal operation.
             #
             # - Remove the circuit from the summer mode assignments
             # - If there aren't any circuits assigned to summer mode anymore
-            #   turn the summer mode OFF.
-            self._bmr.setSummerModeAssignments([self._config.get(CONF_CIRCUIT_ID)], False)
-            if not any(self._bmr.getSummerModeAssignments()):
-                self._bmr.setSummerMode(False)
+            #   turn the summer mode OFF (done by the write batcher).
+            self._writer.async_set_summer_mode_assignments([self._config.get(CONF_CIRCUIT_ID)], False)
 
         if hvac_mode in (HVACMode.HEAT, HVACMode.HEAT_COOL):
             # Turn on the HVAC_MODE_HEAT. This will assign the "override"
             # schedule to the circuit. The "override" schedule is used for
             # setting the custom target temperature (see set_temperature()
             # below).
-            self._bmr.setCircuitSchedules(
+            future = self._writer.async_set_circuit_schedules(
                 self._config.get(CONF_CIRCUIT_ID), [self._config.get(CONF_SCHEDULE_OVERRIDE)],
             )
         else:
@@ -306,7 +414,7 @@ class BmrRoomClimate(ClimateEntity):
             # normal operation.
             #
             # - Assign normal schedules to the circuit
-            self._bmr.setCircuitSchedules(
+            future = self._writer.async_set_circuit_schedules(
                 self._config.get(CONF_CIRCUIT_ID),
                 self._config.get(CONF_SCHEDULE)[CONF_DAY_SCHEDULES],
                 self._config.get(CONF_SCHEDULE).get(CONF_STARTING_DAY, 1),
@@ -317,15 +425,13 @@ class BmrRoomClimate(ClimateEntity):
             # normal operation is restored in the else branches above.
             pass
 
+        return future
+
     @property
     def hvac_action(self):
         """ What is the climate device currently doing (cooling, heating, idle).
         """
-        if (
-            self._summer_mode
-            and self._summer_mode_assignments
-            and self._summer_mode_assignments[self._config.get(CONF_CIRCUIT_ID)]
-        ):
+        if self._controller.is_circuit_off(self._config.get(CONF_CIRCUIT_ID)):
             return HVACAction.OFF
         elif self._circuit.get("heating"):
             return HVACAction.HEATING
@@ -344,18 +450,18 @@ class BmrRoomClimate(ClimateEntity):
     def preset_mode(self):
         """ Current preset mode.
         """
-        if self._low_mode.get("enabled"):
+        if self._controller.low_mode.get("enabled"):
             return PRESET_AWAY
         else:
             return PRESET_NORMAL
 
-    def set_preset_mode(self, preset_mode):
+    async def async_set_preset_mode(self, preset_mode):
         """ Set preset mode.
         """
         if preset_mode == PRESET_AWAY:
-            self._bmr.setLowMode(True, self._away_temperature)
+            await self._writer.async_set_low_mode(True, self._away_temperature)
         else:
-            self._bmr.setLowMode(False)
+            await self._writer.async_set_low_mode(False)
 
     @property
     def supported_features(self):
@@ -363,40 +469,179 @@ class BmrRoomClimate(ClimateEntity):
         """
         return ClimateEntityFeature.TARGET_TEMPERATURE | ClimateEntityFeature.PRESET_MODE
 
-    def set_temperature(self, **kwargs):
+    async def async_set_temperature(self, **kwargs):
         """ Set new target temperature for the circuit. This works by
             modifying the special "override" schedule and assigning the
             schedule to the circuit.
 
             This is being done to avoid overwriting the normal schedule used
             for HVAC_MODE_AUTO.
+
+            Repeated calls (e.g. while the thermostat slider is being dragged)
+            are debounced, only the last temperature is written once it stops
+            changing.
         """
         temperature = kwargs.get(ATTR_TEMPERATURE)
-        self._bmr.setSchedule(
-            self._config.get(CONF_SCHEDULE_OVERRIDE),
-            f"{self._config.get(CONF_NAME)} override",
-            [{"time": "00:00", "temperature": temperature}],
-        )
+        if temperature is None:
+            return
+        written = self._temperature_write.async_request(temperature)
+        self.async_write_ha_state()
+        try:
+            await asyncio.shield(written)
+        finally:
+            # Either the coordinator has the written value now or the write
+            # failed and the controller's value is shown again.
+            self.async_write_ha_state()
+
+    async def _async_write_temperature(self, temperature):
+        """ Write the target temperature to the controller.
+        """
+        writes = [
+            self._writer.async_set_schedule(
+                self._config.get(CONF_SCHEDULE_OVERRIDE),
+                f"{self._config.get(CONF_NAME)} override",
+                [{"time": "00:00", "temperature": temperature}],
+            )
+        ]
         if self.hvac_mode not in (HVACMode.HEAT, HVACMode.HEAT_COOL):
             if self._can_cool:
-                self.set_hvac_mode(HVACMode.HEAT_COOL)
+                writes.append(self._async_queue_hvac_mode(HVACMode.HEAT_COOL))
             else:
-                self.set_hvac_mode(HVACMode.HEAT)
+                writes.append(self._async_queue_hvac_mode(HVACMode.HEAT))
+        await asyncio.gather(*writes)
 
-    @throttle(timedelta(seconds=30))
-    def update(self):
-        """ Fetch new state data for the controller. This is the only method
-            that should fetch new data for Home Assistant.
+    def _async_withdraw_temperature(self, temperature):
+        """ Drop the write of a superseded target temperature unless it is
+            being sent already.
+        """
+        return self._writer.async_withdraw_schedule(self._config.get(CONF_SCHEDULE_OVERRIDE))
+
+    @property
+    def extra_state_attributes(self):
+        if not self._preheat:
+            return None
+        model = self.coordinator.thermal.get(self._config.get(CONF_CIRCUIT_ID))
+        return {
+            "heating_rate": model.heating_rate if model else None,
+            "cooling_rate": model.cooling_rate if model else None,
+            "preheat_start": self._preheat_start,
+            "preheat_until": self._preheating[0] if self._preheating else None,
+        }
+
+    async def async_added_to_hass(self):
+        """ Resume preheating interrupted by a restart, so the circuit is
+            switched back to HVAC_MODE_AUTO when the setpoint starts.
+        """
+        if self._preheat:
+            last_state = await self.async_get_last_state()
+            if last_state is not None and last_state.attributes.get("preheat_until"):
+                until = dt_util.parse_datetime(str(last_state.attributes["preheat_until"]))
+                temperature = last_state.attributes.get(ATTR_TEMPERATURE)
+                if until is not None and temperature is not None:
+                    self._preheating = (until, float(temperature))
+        await super().async_added_to_hass()
+
+    def _next_setpoint(self, now):
+        """ Return (time, temperature) of the next scheduled setpoint higher
+            than the current target temperature, if it starts within
+            MAX_PREHEAT_LEAD. Return None if there isn't any or the
+            timetables weren't read yet.
+        """
+        day_schedules = self._config.get(CONF_SCHEDULE)[CONF_DAY_SCHEDULES]
+        target_temperature = self._circuit.get("target_temperature")
+        if self._schedule.get("day_schedules") != day_schedules or target_temperature is None:
+            return None
+        current_day = self._schedule.get("current_day") or 1
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        for offset in (0, 1):
+            timetable = self.coordinator.timetables.get(day_schedules[(current_day - 1 + offset) % len(day_schedules)])
+            if not timetable:
+                return None
+            for entry in timetable:
+                hours, minutes = (int(x) for x in entry["time"].split(":"))
+                when = dt_util.as_local(midnight + timedelta(days=offset, hours=hours, minutes=minutes))
+                if when <= now:
+                    continue
+                if when - now > MAX_PREHEAT_LEAD:
+                    return None
+                if entry["temperature"] > target_temperature:
+                    return when, float(entry["temperature"])
+        return None
+
+    @callback
+    def _update_preheat(self):
+        """ Start or end preheating, plan the next one.
+        """
+        if self._preheat_write is not None and not self._preheat_write.done():
+            # Wait for the snapshot to reflect the last preheat write.
+            return
+        now = dt_util.now()
+        if self._preheating is not None:
+            until, temperature = self._preheating
+            if self.hvac_mode not in (HVACMode.HEAT, HVACMode.HEAT_COOL) or self.target_temperature != temperature:
+                # Either switched back below or changed by the user.
+                _LOGGER.debug("Preheating of %s ended.", self.name)
+                self._preheating = None
+                self._preheat_start = None
+            elif now >= until:
+                # Kept until the snapshot shows automatic mode, so a failed
+                # write is retried.
+                _LOGGER.debug("Preheating of %s done, restoring automatic mode.", self.name)
+                self._preheat_write = self.hass.async_create_task(
+                    self._async_preheat_write(self._async_queue_hvac_mode(HVACMode.AUTO))
+                )
+            return
+
+        self._preheat_start = None
+        model = self.coordinator.thermal.get(self._config.get(CONF_CIRCUIT_ID))
+        temperature = self.current_temperature
+        if (
+            model is None
+            or temperature is None
+            or self.hvac_mode != HVACMode.AUTO
+            or self.preset_mode != PRESET_NORMAL
+            or self._temperature_write.pending
+        ):
+            return
+        setpoint = self._next_setpoint(now)
+        if setpoint is None or temperature >= setpoint[1]:
+            return
+        lead = model.preheat_lead(temperature, setpoint[1], setpoint[0] - now)
+        if lead is None:
+            return
+        # Rounded, so the attribute doesn't change with every reading.
+        self._preheat_start = (setpoint[0] - lead).replace(second=0, microsecond=0)
+        if now >= self._preheat_start:
+            _LOGGER.debug("Preheating %s to %s until %s.", self.name, setpoint[1], setpoint[0])
+            self._preheating = setpoint
+            self._preheat_write = self.hass.async_create_task(
+                self._async_preheat_write(self._async_write_temperature(setpoint[1]))
+            )
+
+    async def _async_preheat_write(self, write):
+        """ Wait for a write starting or ending preheating. A failed write
+            is only logged, the next update sees the mode didn't change.
         """
         try:
-            circuit = self._bmr.getCircuit(self._config.get(CONF_CIRCUIT_ID))
-            if circuit["temperature"] is None:
-                _LOGGER.warn("BMR HC64 controller returned temperature as None, trying again later.")
-            else:
-                self._circuit = circuit
-            self._schedule = self._bmr.getCircuitSchedules(self._config.get(CONF_CIRCUIT_ID))
-            self._low_mode = self._bmr.getLowMode()
-            self._summer_mode = self._bmr.getSummerMode()
-            self._summer_mode_assignments = self._bmr.getSummerModeAssignments()
-        except socket.timeout:
-            _LOGGER.warn("Read from BMR HC64 controller timed out. Retrying later.")
+            await write
+        except Exception as err:
+            _LOGGER.warning("Can't write preheating of %s: %s", self.name, err)
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the state of the circuit and the controller from the latest
+            snapshot fetched by the coordinator.
+        """
+        data = self.coordinator.data
+        if data:
+            circuit = data["circuits"].get(self._config.get(CONF_CIRCUIT_ID))
+            if circuit is not None:
+                if circuit["temperature"] is None:
+                    _LOGGER.warning("BMR HC64 controller returned temperature as None, trying again later.")
+                else:
+                    self._circuit = circuit
+            self._schedule = data["schedules"].get(self._config.get(CONF_CIRCUIT_ID), self._schedule)
+            self._controller = data["controller"]
+            if self._preheat:
+                self._update_preheat()
+        super()._handle_coordinator_update()
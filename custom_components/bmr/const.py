@@ -0,0 +1,77 @@
+"""
+Constants shared by all BMR HC64 platforms.
+"""
+
+from datetime import timedelta
+
+DOMAIN = "bmr_hc64"
+
+STORAGE_VERSION = 1
+
+CONF_BASE_URL = "base_url"
+
+CONF_REFRESH_INTERVAL = "refresh_interval"
+CONF_SLOW_REFRESH_INTERVAL = "slow_refresh_interval"
+CONF_MAX_CONCURRENT_REQUESTS = "max_concurrent_requests"
+CONF_TEMPERATURE_FILTER = "temperature_filter"
+CONF_TEMPERATURE_FILTER_WINDOW = "temperature_filter_window"
+CONF_DISCOVER_CIRCUITS = "discover_circuits"
+CONF_REQUEST_TIMEOUT = "request_timeout"
+CONF_UPDATE_TIMEOUT = "update_timeout"
+
+# How often the shared coordinator fetches live circuit readings (fast tier)
+# from the controller.
+UPDATE_INTERVAL = timedelta(seconds=30)
+
+# How often rarely changing data (circuit schedule assignments, summer and
+# low mode settings) is fetched (slow tier).
+SLOW_UPDATE_INTERVAL = timedelta(minutes=5)
+
+# How long to wait for the controller to answer a single request.
+REQUEST_TIMEOUT = timedelta(seconds=10)
+
+# How long to keep idle connections to the controller open. Longer than the
+# default refresh interval so the connections survive between update cycles.
+KEEPALIVE_TIMEOUT = 75  # seconds
+
+# Time budget of one update cycle of a controller. A cycle which doesn't
+# finish in time keeps the previous snapshot, reads still waiting in the queue
+# are picked up by the next cycle.
+UPDATE_TIMEOUT = timedelta(minutes=2)
+
+# How long an entity keeps showing the last value (as assumed state) while
+# the part of the snapshot it depends on can't be read, before it becomes
+# unavailable.
+FAILED_READ_TIMEOUT = timedelta(minutes=2)
+
+# How long to wait for more writes before sending a batch to the controller.
+WRITE_BATCH_DELAY = 0.5  # seconds
+
+# How long to wait for the target temperature to stop changing (e.g. while the
+# thermostat slider is being dragged) before writing it.
+TEMPERATURE_DEBOUNCE = timedelta(seconds=1)
+
+# HDO is read at most this far apart once its timetable was learned, to
+# notice switches the timetable doesn't know about.
+HDO_MAX_POLL_INTERVAL = timedelta(minutes=10)
+
+# How long before and after a predicted HDO switch to read it densely, every
+# HDO_DENSE_INTERVAL.
+HDO_EDGE_WINDOW = timedelta(minutes=5)
+HDO_DENSE_INTERVAL = timedelta(seconds=10)
+
+# How long to wait before saving the last snapshot to Home Assistant storage.
+# Pending saves are flushed when Home Assistant stops.
+SNAPSHOT_SAVE_DELAY = 60  # seconds
+
+# How long a roller shutter takes to travel from fully open to fully closed,
+# unless configured otherwise. Its position is interpolated meanwhile.
+SHUTTER_TRAVEL_TIME = timedelta(seconds=30)
+
+# How long to wait after the estimated end of a shutter motion before reading
+# its final position.
+SHUTTER_SETTLE_DELAY = timedelta(seconds=2)
+
+# How long to show optimistic state after a write before giving up waiting for
+# the controller to confirm it. The HC64 may take minutes to apply a change.
+OPTIMISTIC_TIMEOUT = timedelta(minutes=5)
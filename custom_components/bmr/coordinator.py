@@ -0,0 +1,1076 @@
+"""
+Shared data coordinator for the BMR HC64 controller.
+
+All platforms configured with the same `base_url` share a single coordinator.
+The coordinator fetches one snapshot of the controller state per update cycle
+and fans it out to all entities, so the number of HTTP requests sent to the
+(very slow) HC64 controller doesn't grow with the number of entities.
+
+Every controller has its own coordinator, request scheduler and timeouts and
+is polled on its own schedule, so a slow or unreachable controller doesn't
+delay the others.
+"""
+
+import asyncio
+from datetime import datetime
+from hashlib import sha256
+import logging
+import time
+
+import aiohttp
+import voluptuous as vol
+from homeassistant.const import (
+    CONF_PASSWORD,
+    CONF_USERNAME,
+    EVENT_HOMEASSISTANT_CLOSE,
+    EVENT_HOMEASSISTANT_STOP,
+)
+from homeassistant.core import callback
+from homeassistant.exceptions import PlatformNotReady
+import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import Store
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .assignments import mask_circuits, to_mask
+from .breaker import STATE_CLOSED
+from .client import BmrClient, BmrError, BmrUnavailable
+from .const import (
+    CONF_BASE_URL,
+    CONF_MAX_CONCURRENT_REQUESTS,
+    CONF_REFRESH_INTERVAL,
+    CONF_REQUEST_TIMEOUT,
+    CONF_SLOW_REFRESH_INTERVAL,
+    CONF_TEMPERATURE_FILTER,
+    CONF_TEMPERATURE_FILTER_WINDOW,
+    CONF_UPDATE_TIMEOUT,
+    DOMAIN,
+    FAILED_READ_TIMEOUT,
+    HDO_DENSE_INTERVAL,
+    HDO_EDGE_WINDOW,
+    HDO_MAX_POLL_INTERVAL,
+    KEEPALIVE_TIMEOUT,
+    OPTIMISTIC_TIMEOUT,
+    REQUEST_TIMEOUT,
+    SLOW_UPDATE_INTERVAL,
+    SNAPSHOT_SAVE_DELAY,
+    STORAGE_VERSION,
+    UPDATE_INTERVAL,
+    UPDATE_TIMEOUT,
+)
+from .filters import DEFAULT_FILTER, DEFAULT_WINDOW, FILTERS, create_filter
+from .hdo import BmrHdoTimetable
+from .runtime import BmrCircuitRuntime
+from .history import BmrCircuitHistory
+from .thermal import fit_thermal_models
+from .services import async_setup_services
+from .writer import BmrWriteBatcher
+
+_LOGGER = logging.getLogger(__name__)
+
+# Options of the controller, accepted by all platforms.
+CONTROLLER_SCHEMA = {
+    vol.Optional(CONF_REFRESH_INTERVAL): cv.time_period,
+    vol.Optional(CONF_SLOW_REFRESH_INTERVAL): cv.time_period,
+    vol.Optional(CONF_MAX_CONCURRENT_REQUESTS): vol.All(vol.Coerce(int), vol.Range(min=1, max=8)),
+    vol.Optional(CONF_TEMPERATURE_FILTER): vol.In(FILTERS),
+    vol.Optional(CONF_TEMPERATURE_FILTER_WINDOW): vol.All(vol.Coerce(int), vol.Range(min=3, max=32)),
+    vol.Optional(CONF_REQUEST_TIMEOUT): cv.positive_time_period,
+    vol.Optional(CONF_UPDATE_TIMEOUT): cv.positive_time_period,
+}
+
+
+async def async_get_coordinator(hass, config):
+    """ Return the coordinator for the controller specified in the platform
+        configuration. The coordinator (and the controller client) is created
+        on first use and shared by all platforms using the same `base_url`.
+    """
+    base_url = config.get(CONF_BASE_URL)
+    coordinators = hass.data.setdefault(DOMAIN, {}).setdefault("coordinators", {})
+    coordinator = coordinators.get(base_url)
+    if coordinator is None:
+        client = BmrClient(
+            _async_create_session(hass),
+            base_url,
+            config.get(CONF_USERNAME),
+            config.get(CONF_PASSWORD),
+            timeout=REQUEST_TIMEOUT.total_seconds(),
+        )
+        coordinator = coordinators[base_url] = BmrCoordinator(hass, client, base_url)
+        async_setup_services(hass)
+    coordinator.set_refresh_intervals(config.get(CONF_REFRESH_INTERVAL), config.get(CONF_SLOW_REFRESH_INTERVAL))
+    coordinator.client.scheduler.configure(config.get(CONF_MAX_CONCURRENT_REQUESTS))
+    coordinator.set_timeouts(config.get(CONF_REQUEST_TIMEOUT), config.get(CONF_UPDATE_TIMEOUT))
+    coordinator.set_temperature_filter(config.get(CONF_TEMPERATURE_FILTER), config.get(CONF_TEMPERATURE_FILTER_WINDOW))
+    await coordinator.async_setup()
+    return coordinator
+
+
+@callback
+def _async_create_session(hass):
+    """ Create HTTP session dedicated to one controller. Its connections are
+        kept alive between update cycles, so polling doesn't pay for
+        connection setup on every request. The session is closed when Home
+        Assistant stops.
+    """
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(keepalive_timeout=KEEPALIVE_TIMEOUT))
+
+    async def async_close(event):
+        await session.close()
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_CLOSE, async_close)
+    return session
+
+
+async def _async_load_store(hass, name):
+    """ Return the store with data cached by this integration and its
+        content. Each store is loaded only once, the stores are:
+
+        - identities: base URL -> unique ID of the controller
+        - circuits: base URL -> discovered circuits (see async_discover_circuits())
+        - snapshots: base URL -> last snapshot read from the controller
+        - hdo: base URL -> learned HDO timetable (see BmrHdoTimetable)
+        - runtime: base URL -> heating runtime of circuits (see BmrCircuitRuntime)
+    """
+    stores = hass.data.setdefault(DOMAIN, {}).setdefault("stores", {})
+    if name not in stores:
+
+        async def load():
+            store = Store(hass, STORAGE_VERSION, f"{DOMAIN}.{name}")
+            return store, (await store.async_load()) or {}
+
+        stores[name] = hass.async_create_task(load())
+    return await stores[name]
+
+
+@callback
+def _async_delay_save(hass, name, store, data_func):
+    """ Save the store loaded by _async_load_store() SNAPSHOT_SAVE_DELAY
+        after its first change since the last save. Store.async_delay_save()
+        restarts the delay on every call, so a store changed every update
+        cycle would be saved only when Home Assistant stops.
+    """
+    pending = hass.data[DOMAIN].setdefault("pending_saves", set())
+    if name in pending:
+        return
+    pending.add(name)
+
+    def data_to_save():
+        pending.discard(name)
+        return data_func()
+
+    store.async_delay_save(data_to_save, SNAPSHOT_SAVE_DELAY)
+
+
+class BmrCoordinator(DataUpdateCoordinator):
+    """ Fetch the state of the HC64 controller once per update cycle.
+
+        Entities register what they need (circuits, circuit schedules,
+        controller-wide state, HDO) and the coordinator reads each of these
+        exactly once per cycle. The snapshot is a dict with the following
+        keys:
+
+        - circuits: circuit ID -> result of getCircuit(), the temperature
+          passed through the temperature filter of the circuit (the value
+          read from the controller is kept as raw_temperature)
+        - schedules: circuit ID -> result of getCircuitSchedules()
+        - controller: BmrControllerState shared by all entities
+        - hdo: result of getHDO(), read on its own schedule, see
+          _async_poll_hdo()
+        - shutters: shutter ID -> result of getWholeRollerShutter()
+
+        Timetables of the day schedules of preheated circuits are read in
+        the slow tier too, but kept outside of the snapshot (see
+        `timetables`).
+
+        Live circuit readings are refreshed every cycle (fast tier), rarely
+        changing data (schedule assignments and the controller-wide state) only
+        once per slow refresh interval (slow tier) or right after this
+        integration writes to it.
+
+        Values written to the controller are applied to the snapshot right
+        away (optimistically) and kept until a poll confirms them or until
+        OPTIMISTIC_TIMEOUT passes, then the polled value wins again.
+
+        Roller shutters are read every cycle too, except while they move after
+        a command: the cover entity estimates their position meanwhile and
+        confirms it with a single read once the motion should be over (see
+        async_move_shutter()).
+
+        The last snapshot is saved to Home Assistant storage. After a restart
+        the entities start from the saved snapshot, marked as stale, until
+        the first refresh replaces it.
+
+        While the circuit breaker of the client is open (the controller
+        stopped responding) the update fails right away and the entities are
+        unavailable instead of showing the last snapshot as current. Polling
+        resumes once a probe request gets an answer.
+
+        A single part of the snapshot which can't be read keeps its previous
+        value and is listed in `failed`, its entities report assumed state
+        and become unavailable after FAILED_READ_TIMEOUT. The update fails
+        only if nothing could be read.
+    """
+
+    def __init__(self, hass, client, base_url):
+        super().__init__(hass, _LOGGER, name=f"BMR HC64 {base_url}", update_interval=UPDATE_INTERVAL)
+        self.client = client
+        self.writer = BmrWriteBatcher(hass, client, on_write=self.async_handle_write)
+        self.base_url = base_url
+        self.unique_id = None
+        self.metrics_sensors_added = False
+
+        self._circuit_ids = set()
+        self._schedule_circuit_ids = set()
+        self._controller_state = False
+        self._hdo = False
+        self._shutter_ids = set()
+        self._runtime_circuit_ids = set()
+        self._preheat_circuit_ids = set()
+        self._timetable_ids = set()
+        self._moving_shutters = set()
+        self._setup_lock = asyncio.Lock()
+        self._discovery = None
+
+        # Temperature filter: circuit ID -> filter instance
+        self._filter_name = DEFAULT_FILTER
+        self._filter_window = DEFAULT_WINDOW
+        self._filter_configured = False
+        self._temperature_filters = {}
+
+        # Recent readings of the circuits: circuit ID -> BmrCircuitHistory
+        self.history = {}
+
+        # Heating runtime of the circuits with runtime sensors: circuit ID ->
+        # BmrCircuitRuntime
+        self.runtime = {}
+        self._runtime_store = None
+
+        # Thermal models of the preheated circuits, refitted every cycle:
+        # circuit ID -> BmrThermalModel
+        self.thermal = {}
+
+        # Timetables of the day schedules of the preheated circuits:
+        # schedule ID -> timetable as returned by getSchedule()
+        self.timetables = {}
+
+        # Slow tier: key -> time of the last refresh
+        self.slow_update_interval = SLOW_UPDATE_INTERVAL
+        self._slow_refreshed = {}
+        self._slow_invalidated = set()
+        self._fast_configured = None
+        self._slow_configured = None
+
+        # Timeouts of a single request and of a whole update cycle
+        self.request_timeout = REQUEST_TIMEOUT
+        self.update_timeout = UPDATE_TIMEOUT
+        self._request_timeout_configured = False
+        self._update_timeout_configured = False
+
+        # Last snapshot as read from the controller and the optimistic values
+        # applied on top of it: key -> (value, expiration)
+        self._polled = None
+        self._optimistic = {}
+
+        # Parts of the snapshot which changed in the last update, None if
+        # unknown (i.e. everything may have changed).
+        self.changed = None
+
+        # True while the data is the snapshot saved before the restart.
+        self.stale = False
+
+        # Snapshot parts which couldn't be read in the last update and keep
+        # their previous value: key (see _diff_snapshots()) -> time.monotonic()
+        # of the first failure in a row.
+        self.failed = {}
+        self._snapshots = None
+
+        # HDO is read by its own timer, following the learned timetable.
+        self.hdo_timetable = BmrHdoTimetable()
+        self.hdo_prediction = None
+        self._hdo_value = None
+        self._hdo_store = None
+        self._unsub_hdo = None
+
+    async def async_setup(self):
+        """ Resolve the unique ID of the controller. This is done only once
+            per controller, not once per entity, and the result is cached in
+            Home Assistant storage so later startups don't have to wait for
+            the controller at all.
+        """
+        async with self._setup_lock:
+            if self.unique_id is not None:
+                return
+            store, identities = await _async_load_store(self.hass, "identities")
+            unique_id = identities.get(self.base_url)
+            if unique_id is None:
+                try:
+                    unique_id = await self.client.getUniqueId()
+                except (asyncio.TimeoutError, aiohttp.ClientError, BmrError) as err:
+                    raise PlatformNotReady(f"Can't read identity of BMR HC64 controller {self.base_url}") from err
+                coordinators = self.hass.data[DOMAIN]["coordinators"]
+                if any(c is not self and c.unique_id == unique_id for c in coordinators.values()):
+                    # Another controller has the same circuit names.
+                    unique_id = sha256(f"{unique_id}\0{self.base_url}".encode("utf-8")).hexdigest()[:8]
+                else:
+                    # The controller was cached under another URL before (its
+                    # address changed), the old entry is outdated.
+                    for base_url, cached in list(identities.items()):
+                        if cached == unique_id and base_url not in coordinators:
+                            del identities[base_url]
+                identities[self.base_url] = unique_id
+                store.async_delay_save(lambda: identities, 1)
+            self.unique_id = unique_id
+            await self._async_restore_snapshot()
+            await self._async_restore_hdo_timetable()
+            await self._async_restore_runtime()
+
+    async def _async_restore_snapshot(self):
+        """ Start from the snapshot saved before the restart, if any.
+        """
+        self._snapshots = await _async_load_store(self.hass, "snapshots")
+        saved = self._snapshots[1].get(self.base_url)
+        if saved is None or saved["unique_id"] != self.unique_id:
+            return
+        try:
+            self._polled = _snapshot_from_json(saved["data"])
+        except (KeyError, TypeError, ValueError):
+            _LOGGER.warning("Ignoring malformed saved snapshot of BMR HC64 controller %s", self.base_url)
+            return
+        _LOGGER.debug("Restored snapshot of BMR HC64 controller %s saved at %s", self.base_url, saved["saved_at"])
+        self.stale = True
+        self._hdo_value = self._polled["hdo"]
+        self.data = self._apply_optimistic(self._polled)
+
+    async def _async_restore_hdo_timetable(self):
+        """ Load the HDO timetable learned before the restart, if any.
+        """
+        self._hdo_store = await _async_load_store(self.hass, "hdo")
+        saved = self._hdo_store[1].get(self.base_url)
+        if saved is not None and saved["unique_id"] == self.unique_id:
+            self.hdo_timetable = BmrHdoTimetable.from_dict(saved["timetable"])
+
+    @callback
+    def _async_save_snapshot(self):
+        """ Save the last polled snapshot (later, see SNAPSHOT_SAVE_DELAY).
+        """
+        if self._snapshots is None:
+            return
+        store, snapshots = self._snapshots
+        snapshots[self.base_url] = {
+            "unique_id": self.unique_id,
+            "saved_at": datetime.now().isoformat(),
+            "data": _snapshot_to_json(self._polled),
+        }
+        _async_delay_save(self.hass, "snapshots", store, lambda: snapshots)
+
+    async def async_discover_circuits(self):
+        """ Return circuits present and enabled in the controller as a list
+            of dicts with keys circuit, name, day_schedules and starting_day.
+
+            The names of all circuits are read in a single request, then only
+            the circuits which exist are probed, all at once. The request
+            scheduler bounds how many of the requests are in flight. The
+            result is cached in Home Assistant storage, later startups don't
+            scan again. All platforms of the controller share one scan.
+        """
+        if self._discovery is None:
+            self._discovery = self.hass.async_create_task(self._async_discover_circuits())
+        try:
+            return await asyncio.shield(self._discovery)
+        except PlatformNotReady:
+            self._discovery = None
+            raise
+
+    async def _async_discover_circuits(self):
+        store, discovered = await _async_load_store(self.hass, "circuits")
+        cached = discovered.get(self.base_url)
+        if cached is not None and cached["unique_id"] == self.unique_id:
+            return cached["circuits"]
+
+        async def probe(circuit_id, name):
+            circuit, schedules = await asyncio.gather(
+                self.client.getCircuit(circuit_id), self.client.getCircuitSchedules(circuit_id)
+            )
+            if not circuit["enabled"]:
+                return None
+            return {
+                "circuit": circuit_id,
+                "name": name,
+                "day_schedules": schedules["day_schedules"],
+                "starting_day": schedules["starting_day"],
+            }
+
+        try:
+            names = await self.client.getCircuitNames()
+            circuits = await asyncio.gather(*(probe(circuit_id, name) for circuit_id, name in enumerate(names) if name))
+        except (asyncio.TimeoutError, aiohttp.ClientError, BmrError) as err:
+            raise PlatformNotReady(f"Can't discover circuits of BMR HC64 controller {self.base_url}") from err
+        circuits = [circuit for circuit in circuits if circuit is not None]
+        _LOGGER.info("Discovered %d circuits of BMR HC64 controller %s", len(circuits), self.base_url)
+        discovered[self.base_url] = {"unique_id": self.unique_id, "circuits": circuits}
+        store.async_delay_save(lambda: discovered, 1)
+        return circuits
+
+    @callback
+    def async_schedule_refresh(self):
+        """ Refresh the data in the background, e.g. after new entities were
+            registered. Platform setup doesn't wait for the controller.
+        """
+        self.hass.async_create_background_task(self.async_request_refresh(), f"{self.name} refresh")
+
+    def has_changed(self, keys=None):
+        """ Return True if any of the snapshot parts changed in the last
+            update. See _diff_snapshots() for the keys.
+        """
+        if keys is None or self.changed is None:
+            return True
+        return any(key in self.changed for key in keys)
+
+    def is_failing(self, keys=None):
+        """ Return True if any of the snapshot parts couldn't be read in the
+            last update, i.e. it shows an older value.
+        """
+        return keys is not None and any(key in self.failed for key in keys)
+
+    def has_failed(self, keys=None):
+        """ Return True if any of the snapshot parts couldn't be read for
+            longer than FAILED_READ_TIMEOUT.
+        """
+        if keys is None:
+            return False
+        since = time.monotonic() - FAILED_READ_TIMEOUT.total_seconds()
+        return any(self.failed.get(key, since) < since for key in keys)
+
+    def set_refresh_intervals(self, fast=None, slow=None):
+        """ Configure refresh intervals of the fast and slow tier. When several
+            platforms configure the same controller the shortest interval wins.
+        """
+        if fast is not None and (self._fast_configured is None or fast < self.update_interval):
+            self._fast_configured = fast
+            self.update_interval = fast
+        if slow is not None and (self._slow_configured is None or slow < self.slow_update_interval):
+            self._slow_configured = slow
+            self.slow_update_interval = slow
+            self.writer.max_age = slow
+
+    def set_timeouts(self, request=None, update=None):
+        """ Configure timeouts of a single request and of a whole update
+            cycle. When several platforms configure the same controller the
+            shortest timeout wins.
+        """
+        if request is not None and (not self._request_timeout_configured or request < self.request_timeout):
+            self._request_timeout_configured = True
+            self.request_timeout = request
+            self.client.set_timeout(request.total_seconds())
+        if update is not None and (not self._update_timeout_configured or update < self.update_timeout):
+            self._update_timeout_configured = True
+            self.update_timeout = update
+
+    def set_temperature_filter(self, name=None, window=None):
+        """ Configure the filter applied to circuit temperatures. When several
+            platforms configure the same controller the first one wins.
+        """
+        if self._filter_configured or (name is None and window is None):
+            return
+        self._filter_configured = True
+        self._filter_name = name or self._filter_name
+        self._filter_window = window or self._filter_window
+        self._temperature_filters.clear()
+
+    def _filter_temperature(self, circuit_id, circuit):
+        """ Pass the temperature of the circuit through its filter. Called
+            exactly once per sample.
+        """
+        temperature = circuit.get("temperature")
+        if temperature is None:
+            return circuit
+        temperature_filter = self._temperature_filters.get(circuit_id)
+        if temperature_filter is None:
+            temperature_filter = create_filter(self._filter_name, self._filter_window)
+            self._temperature_filters[circuit_id] = temperature_filter
+        filtered = temperature_filter.update(temperature)
+        if filtered != temperature:
+            _LOGGER.debug("Filtered temperature of circuit %d: %s -> %s", circuit_id, temperature, filtered)
+        return {**circuit, "temperature": filtered, "raw_temperature": temperature}
+
+    def track_circuit(self, circuit_id, schedules=False):
+        """ Include the circuit (and optionally its schedule assignments) in
+            the snapshot.
+        """
+        self._circuit_ids.add(circuit_id)
+        if schedules:
+            self._schedule_circuit_ids.add(circuit_id)
+
+    def track_runtime(self, circuit_id):
+        """ Include the circuit in the snapshot and account its heating
+            runtime.
+        """
+        self.track_circuit(circuit_id)
+        self._runtime_circuit_ids.add(circuit_id)
+
+    def track_preheat(self, circuit_id, schedule_ids):
+        """ Include the circuit, its schedule assignments and the timetables
+            of its day schedules in the snapshot and fit its thermal model.
+        """
+        self.track_circuit(circuit_id, schedules=True)
+        self._preheat_circuit_ids.add(circuit_id)
+        self._timetable_ids.update(schedule_ids)
+
+    def track_controller_state(self):
+        """ Include the controller-wide state (low mode, summer mode and
+            summer mode assignments) in the snapshot.
+        """
+        self._controller_state = True
+
+    def track_hdo(self):
+        """ Include the HDO state in the snapshot and start reading it.
+        """
+        if self._hdo:
+            return
+        self._hdo = True
+
+        @callback
+        def async_stop(event):
+            if self._unsub_hdo is not None:
+                self._unsub_hdo()
+                self._unsub_hdo = None
+
+        self.hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_stop)
+        self._unsub_hdo = async_call_later(self.hass, 0, self._async_poll_hdo)
+
+    async def _async_poll_hdo(self, _now=None):
+        """ Read HDO and plan the next read.
+
+            Until the timetable learned some switching times HDO is read
+            once per update interval. Then it is read rarely (see
+            HDO_MAX_POLL_INTERVAL) except around the predicted switch (see
+            HDO_EDGE_WINDOW), where it is read every HDO_DENSE_INTERVAL.
+            The read doesn't postpone the regular update cycle.
+        """
+        self._unsub_hdo = None
+        try:
+            value = await self.client.getHDO()
+        except (asyncio.TimeoutError, aiohttp.ClientError, BmrError) as err:
+            _LOGGER.debug("Can't read HDO of BMR HC64 controller %s: %s", self.base_url, err)
+            self._unsub_hdo = async_call_later(self.hass, self.update_interval, self._async_poll_hdo)
+            return
+
+        now = dt_util.now()
+        if self.hdo_timetable.observe(now, value):
+            self._async_save_hdo_timetable()
+        prediction = self.hdo_timetable.predict(now, HDO_EDGE_WINDOW)
+        if (value, prediction) != (self._hdo_value, self.hdo_prediction):
+            self._hdo_value = value
+            self.hdo_prediction = prediction
+            if self._polled is not None:
+                self._polled["hdo"] = value
+                data = self._apply_optimistic(self._polled)
+                self.changed = (_diff_snapshots(self.data, data) or set()) | {("hdo",)}
+                self.data = data
+                self.async_update_listeners()
+
+        if prediction is None:
+            delay = self.update_interval
+        elif now >= prediction[0] - HDO_EDGE_WINDOW:
+            delay = HDO_DENSE_INTERVAL
+        else:
+            delay = min(prediction[0] - HDO_EDGE_WINDOW - now, HDO_MAX_POLL_INTERVAL)
+        self._unsub_hdo = async_call_later(self.hass, delay, self._async_poll_hdo)
+
+    async def _async_restore_runtime(self):
+        """ Load the heating runtime of circuits saved before the restart.
+        """
+        self._runtime_store = await _async_load_store(self.hass, "runtime")
+        saved = self._runtime_store[1].get(self.base_url)
+        if saved is None or saved["unique_id"] != self.unique_id:
+            return
+        for circuit_id, runtime in saved["circuits"].items():
+            self.runtime[int(circuit_id)] = BmrCircuitRuntime.from_dict(runtime)
+
+    @callback
+    def _async_save_runtime(self):
+        """ Save the heating runtime of circuits (later, see
+            SNAPSHOT_SAVE_DELAY).
+        """
+        if self._runtime_store is None or not self.runtime:
+            return
+        store, runtimes = self._runtime_store
+        runtimes[self.base_url] = {
+            "unique_id": self.unique_id,
+            "circuits": {str(circuit_id): runtime.as_dict() for circuit_id, runtime in self.runtime.items()},
+        }
+        _async_delay_save(self.hass, "runtime", store, lambda: runtimes)
+
+    @callback
+    def _async_save_hdo_timetable(self):
+        """ Save the learned HDO timetable (later, see SNAPSHOT_SAVE_DELAY).
+        """
+        if self._hdo_store is None:
+            return
+        store, timetables = self._hdo_store
+        timetables[self.base_url] = {"unique_id": self.unique_id, "timetable": self.hdo_timetable.as_dict()}
+        _async_delay_save(self.hass, "hdo", store, lambda: timetables)
+
+    def track_shutter(self, shutter_id):
+        """ Include the roller shutter in the snapshot.
+        """
+        self._shutter_ids.add(shutter_id)
+
+    async def async_move_shutter(self, shutter_id, position, tilt):
+        """ Move the roller shutter. Return True if the controller accepted
+            the command. The shutter isn't read again until
+            async_confirm_shutter() is called when it stops moving.
+        """
+        self._moving_shutters.add(shutter_id)
+        accepted = False
+        try:
+            accepted = await self.client.saveManualChange(shutter_id, position, tilt)
+        finally:
+            if not accepted:
+                self._moving_shutters.discard(shutter_id)
+        return accepted
+
+    def is_shutter_moving(self, shutter_id):
+        """ Return True if the roller shutter moves, i.e. it isn't read.
+        """
+        return shutter_id in self._moving_shutters
+
+    async def async_confirm_shutter(self, shutter_id):
+        """ Read the roller shutter which stopped moving, once, and pass the
+            result to the entities.
+        """
+        try:
+            shutter = await self.client.getWholeRollerShutter(shutter_id)
+        except (asyncio.TimeoutError, aiohttp.ClientError, BmrError) as err:
+            _LOGGER.warning(
+                "Can't read roller shutter %d of BMR HC64 controller %s: %s", shutter_id, self.base_url, err
+            )
+            return
+        finally:
+            self._moving_shutters.discard(shutter_id)
+        if self._polled is None:
+            return
+        self._polled["shutters"][shutter_id] = shutter
+        data = self._apply_optimistic(self._polled)
+        self.changed = _diff_snapshots(self.data, data)
+        self.async_set_updated_data(data)
+
+    async def _async_update_data(self):
+        """ Fetch new snapshot of the controller state.
+        """
+        failed = self.failed
+        try:
+            self._polled, read_at = await asyncio.wait_for(self._async_fetch(), self.update_timeout.total_seconds())
+            self._record_history(self._polled)
+            self._record_runtime(self._polled)
+            self._fit_thermal_models()
+            self.writer.update_known(self._polled, read_at)
+            self._async_save_snapshot()
+            was_stale, self.stale = self.stale, False
+        except BmrUnavailable as err:
+            raise UpdateFailed(str(err)) from err
+        except (BmrError, aiohttp.ClientError) as err:
+            raise UpdateFailed(f"Can't read BMR HC64 controller {self.base_url}: {err}") from err
+        except asyncio.TimeoutError as err:
+            if not self.client.breaker.available():
+                raise UpdateFailed(f"Controller {self.base_url} isn't responding") from err
+            _LOGGER.warning("Read from BMR HC64 controller %s timed out. Retrying later.", self.base_url)
+            if self._polled is None:
+                return None
+            was_stale = False
+        data = self._apply_optimistic(self._polled)
+        # Entities of a stale snapshot must be written even if nothing
+        # changed, they are not stale anymore.
+        self.changed = None if was_stale else _diff_snapshots(self.data, data)
+        if self.changed is not None:
+            # Entities of parts which started or stopped failing are assumed
+            # or not anymore.
+            self.changed |= failed.keys() ^ self.failed.keys()
+        return data
+
+    def _record_runtime(self, data):
+        """ Account the heating runtime of the circuits since the last
+            update.
+        """
+        now = time.time()
+        for circuit_id in self._runtime_circuit_ids:
+            circuit = data["circuits"].get(circuit_id)
+            if circuit is None or ("circuit", circuit_id) in self.failed:
+                continue
+            runtime = self.runtime.get(circuit_id)
+            if runtime is None:
+                runtime = self.runtime[circuit_id] = BmrCircuitRuntime()
+            runtime.update(now, circuit)
+        self._async_save_runtime()
+
+    def _fit_thermal_models(self):
+        """ Refit the thermal models of the preheated circuits, all of them
+            in a single batch.
+        """
+        if self._preheat_circuit_ids:
+            histories = {
+                circuit_id: self.history[circuit_id]
+                for circuit_id in self._preheat_circuit_ids
+                if circuit_id in self.history
+            }
+            self.thermal = fit_thermal_models(histories)
+
+    def _record_history(self, data):
+        """ Append the circuit readings of the snapshot to their history.
+        """
+        now = time.time()
+        for circuit_id, circuit in data["circuits"].items():
+            if ("circuit", circuit_id) in self.failed:
+                continue
+            history = self.history.get(circuit_id)
+            if history is None:
+                history = self.history[circuit_id] = BmrCircuitHistory()
+            history.append(now, circuit)
+
+    @callback
+    def async_handle_write(self, batch):
+        """ Apply values successfully written to the controller to the
+            snapshot so the entities show them immediately.
+        """
+        optimistic = {}
+        for circuit_id, (day_schedules, _) in batch.circuit_schedules.items():
+            optimistic[("day_schedules", circuit_id)] = day_schedules
+        if batch.summer_mode is not None:
+            optimistic[("summer_mode",)] = batch.summer_mode
+        for circuit_id in mask_circuits(batch.summer_mode_assign):
+            optimistic[("summer_mode_assignment", circuit_id)] = True
+        for circuit_id in mask_circuits(batch.summer_mode_unassign):
+            optimistic[("summer_mode_assignment", circuit_id)] = False
+        if batch.low_mode is not None:
+            optimistic[("low_mode",)] = batch.low_mode[0]
+
+        # Re-read whatever was written in the next cycle, don't wait for the
+        # slow tier.
+        for circuit_id in batch.circuit_schedules:
+            self._slow_invalidated.add(("schedules", circuit_id))
+        for schedule_id in batch.schedules:
+            if schedule_id in self._timetable_ids:
+                self._slow_invalidated.add(("timetable", schedule_id))
+        if (
+            batch.summer_mode is not None
+            or batch.summer_mode_assign
+            or batch.summer_mode_unassign
+            or batch.low_mode is not None
+        ):
+            self._slow_invalidated.add(("controller",))
+
+        # A schedule with a single timetable entry sets a fixed target
+        # temperature for all circuits using only this schedule.
+        if self.data:
+            controller = self.data["controller"]
+            for schedule_id, (_, timetable) in batch.schedules.items():
+                if len(timetable) != 1 or optimistic.get(("low_mode",), controller.low_mode.get("enabled")):
+                    continue
+                for circuit_id in self._schedule_circuit_ids:
+                    day_schedules = optimistic.get(
+                        ("day_schedules", circuit_id), self.data["schedules"].get(circuit_id, {}).get("day_schedules")
+                    )
+                    if day_schedules == [schedule_id] and not controller.is_circuit_off(circuit_id):
+                        optimistic[("target_temperature", circuit_id)] = float(timetable[0]["temperature"])
+
+        expiration = time.monotonic() + OPTIMISTIC_TIMEOUT.total_seconds()
+        for key, value in optimistic.items():
+            self._optimistic[key] = (value, expiration)
+        if self._polled is not None:
+            data = self._apply_optimistic(self._polled)
+            self.changed = _diff_snapshots(self.data, data)
+            self.async_set_updated_data(data)
+
+    def _apply_optimistic(self, polled):
+        """ Return copy of the polled snapshot with the optimistic values
+            applied. Drop optimistic values confirmed by the controller or
+            expired.
+        """
+        now = time.monotonic()
+        data = {
+            **polled,
+            "circuits": dict(polled["circuits"]),
+            "schedules": dict(polled["schedules"]),
+            "controller": polled["controller"].copy(),
+            "shutters": dict(polled["shutters"]),
+        }
+        for key, (value, expiration) in list(self._optimistic.items()):
+            if _get_snapshot_value(polled, key) == value:
+                del self._optimistic[key]
+            elif expiration < now:
+                _LOGGER.debug("Controller didn't confirm %s=%s, rolling back.", key, value)
+                del self._optimistic[key]
+            else:
+                _set_snapshot_value(data, key, value)
+        return data
+
+    async def _async_fetch_controller_state(self):
+        """ Read the controller-wide state.
+        """
+        low_mode, summer_mode, summer_mode_assignments = await asyncio.gather(
+            self.client.getLowMode(), self.client.getSummerMode(), self.client.getSummerModeAssignments(),
+        )
+        return BmrControllerState(low_mode, summer_mode, to_mask(summer_mode_assignments))
+
+    async def _async_fetch(self):
+        """ Read everything the registered entities need from the controller.
+            Slow tier items which are still fresh are taken from the previous
+            snapshot.
+
+            Return the snapshot and the time (see time.monotonic()) the slow
+            tier items read in this cycle were requested at: key -> time.
+
+            An item which can't be read keeps its previous value and is
+            listed in `failed`, slow tier items are read again in the next
+            cycle. The cycle fails only if no item could be read.
+        """
+        now = time.monotonic()
+        previous = self._polled or {"circuits": {}, "schedules": {}, "controller": BmrControllerState(), "shutters": {}}
+        invalidated, self._slow_invalidated = self._slow_invalidated, set()
+        refreshed = {}
+        read_at = {}
+        timetables = {}
+
+        def is_stale(key):
+            return (
+                key in invalidated
+                or key not in self._slow_refreshed
+                or now - self._slow_refreshed[key] >= self.slow_update_interval.total_seconds()
+            )
+
+        data = {
+            "circuits": {},
+            "schedules": {},
+            "controller": previous["controller"],
+            "hdo": self._hdo_value,
+            "shutters": {},
+        }
+
+        async def fetch_controller_state():
+            sent = time.monotonic()
+            data["controller"] = await self._async_fetch_controller_state()
+            refreshed[("controller",)] = now
+            read_at[("controller",)] = sent
+
+        async def fetch_circuit(circuit_id):
+            circuit = await self.client.getCircuit(circuit_id)
+            data["circuits"][circuit_id] = self._filter_temperature(circuit_id, circuit)
+
+        async def fetch_schedules(circuit_id):
+            sent = time.monotonic()
+            data["schedules"][circuit_id] = await self.client.getCircuitSchedules(circuit_id)
+            refreshed[("schedules", circuit_id)] = now
+            read_at[("schedules", circuit_id)] = sent
+
+        async def fetch_timetable(schedule_id):
+            timetables[schedule_id] = (await self.client.getSchedule(schedule_id))["timetable"]
+            refreshed[("timetable", schedule_id)] = now
+
+        async def fetch_shutter(shutter_id):
+            data["shutters"][shutter_id] = await self.client.getWholeRollerShutter(shutter_id)
+
+        # All the reads are queued at once, the request scheduler of the
+        # client decides how many of them run in parallel.
+        reads = []
+        if self._controller_state and is_stale(("controller",)):
+            reads.append((("controller",), fetch_controller_state()))
+        for circuit_id in sorted(self._circuit_ids):
+            reads.append((("circuit", circuit_id), fetch_circuit(circuit_id)))
+        for circuit_id in sorted(self._schedule_circuit_ids):
+            if circuit_id in previous["schedules"] and not is_stale(("schedules", circuit_id)):
+                data["schedules"][circuit_id] = previous["schedules"][circuit_id]
+            else:
+                reads.append((("schedules", circuit_id), fetch_schedules(circuit_id)))
+        for schedule_id in sorted(self._timetable_ids):
+            if schedule_id not in self.timetables or is_stale(("timetable", schedule_id)):
+                reads.append((("timetable", schedule_id), fetch_timetable(schedule_id)))
+        moving = set(self._moving_shutters)
+        for shutter_id in sorted(self._shutter_ids - moving):
+            reads.append((("shutter", shutter_id), fetch_shutter(shutter_id)))
+        keys = [key for key, _ in reads]
+        reads = [read for _, read in reads]
+        results = []
+        try:
+            if reads and self.client.breaker.state != STATE_CLOSED:
+                # The controller stopped responding. Probe it with a single
+                # read, the others are sent only if it answers.
+                probe = reads.pop(0)
+                try:
+                    results.append(await probe)
+                except BaseException:
+                    for read in reads:
+                        read.close()
+                    raise
+            results += await asyncio.gather(*reads, return_exceptions=True)
+        except BaseException:
+            # Nothing from this cycle is kept, read the invalidated items
+            # again next time.
+            self._slow_invalidated |= invalidated
+            raise
+        failed = {key: result for key, result in zip(keys, results) if isinstance(result, BaseException)}
+        if failed and len(failed) == len(keys):
+            self._slow_invalidated |= invalidated
+            raise next(iter(failed.values()))
+
+        for key, err in failed.items():
+            if key not in self.failed:
+                _LOGGER.warning(
+                    "Can't read %s of BMR HC64 controller %s, keeping the last value: %s", key, self.base_url, err
+                )
+            section = {"circuit": "circuits", "schedules": "schedules", "shutter": "shutters"}.get(key[0])
+            if section is not None and key[1] in previous[section]:
+                data[section][key[1]] = previous[section][key[1]]
+            if key[0] in ("controller", "schedules", "timetable"):
+                self._slow_invalidated.add(key)
+        for key in self.failed.keys() - failed.keys():
+            _LOGGER.info("Reading %s of BMR HC64 controller %s recovered", key, self.base_url)
+        self.failed = {key: self.failed.get(key, now) for key in failed}
+
+        self._slow_refreshed.update(refreshed)
+        self.timetables.update(timetables)
+        # Shutters which were moving keep their last value, which may have
+        # been confirmed in the meantime.
+        for shutter_id in moving & self._shutter_ids:
+            shutter = (self._polled or {}).get("shutters", {}).get(shutter_id)
+            if shutter is not None:
+                data["shutters"][shutter_id] = shutter
+        return data, read_at
+
+
+def _diff_snapshots(old, new):
+    """ Return keys of the snapshot parts which differ:
+
+        - ("circuit", circuit ID)
+        - ("schedules", circuit ID)
+        - ("controller",)
+        - ("hdo",)
+        - ("shutter", shutter ID)
+    """
+    if not old or not new:
+        return None
+    changed = set()
+    for kind, section in (("circuit", "circuits"), ("schedules", "schedules"), ("shutter", "shutters")):
+        for item_id in old[section].keys() | new[section].keys():
+            if old[section].get(item_id) != new[section].get(item_id):
+                changed.add((kind, item_id))
+    if old["controller"] != new["controller"]:
+        changed.add(("controller",))
+    if old["hdo"] != new["hdo"]:
+        changed.add(("hdo",))
+    return changed
+
+
+def _snapshot_to_json(data):
+    """ Convert the snapshot to data which can be saved to storage.
+    """
+    controller = data["controller"]
+    return {
+        "circuits": {str(circuit_id): circuit for circuit_id, circuit in data["circuits"].items()},
+        "schedules": {str(circuit_id): schedules for circuit_id, schedules in data["schedules"].items()},
+        "controller": {
+            "low_mode": {
+                key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in controller.low_mode.items()
+            },
+            "summer_mode": controller.summer_mode,
+            "summer_mode_assignments": controller.summer_mode_assignments,
+        },
+        "hdo": data["hdo"],
+        "shutters": {str(shutter_id): shutter for shutter_id, shutter in data["shutters"].items()},
+    }
+
+
+def _snapshot_from_json(data):
+    """ Convert data saved by _snapshot_to_json() back to a snapshot.
+    """
+    controller = data["controller"]
+    low_mode = dict(controller["low_mode"])
+    for key in ("start_date", "end_date"):
+        if low_mode.get(key):
+            low_mode[key] = datetime.fromisoformat(low_mode[key])
+    return {
+        "circuits": {int(circuit_id): circuit for circuit_id, circuit in data["circuits"].items()},
+        "schedules": {int(circuit_id): schedules for circuit_id, schedules in data["schedules"].items()},
+        "controller": BmrControllerState(low_mode, controller["summer_mode"], controller["summer_mode_assignments"]),
+        "hdo": data["hdo"],
+        "shutters": {int(shutter_id): shutter for shutter_id, shutter in data.get("shutters", {}).items()},
+    }
+
+
+def _get_snapshot_value(data, key):
+    """ Return value identified by the optimistic key from the snapshot.
+    """
+    kind = key[0]
+    if kind == "target_temperature":
+        return data["circuits"].get(key[1], {}).get("target_temperature")
+    elif kind == "day_schedules":
+        return data["schedules"].get(key[1], {}).get("day_schedules")
+    elif kind == "summer_mode":
+        return data["controller"].summer_mode
+    elif kind == "summer_mode_assignment":
+        return bool(data["controller"].summer_mode_assignments >> key[1] & 1)
+    elif kind == "low_mode":
+        return data["controller"].low_mode.get("enabled")
+
+
+def _set_snapshot_value(data, key, value):
+    """ Set value identified by the optimistic key in the snapshot. The
+        snapshot must be a copy made by _apply_optimistic().
+    """
+    kind = key[0]
+    if kind == "target_temperature" and key[1] in data["circuits"]:
+        data["circuits"][key[1]] = {**data["circuits"][key[1]], "target_temperature": value}
+    elif kind == "day_schedules":
+        data["schedules"][key[1]] = {**data["schedules"].get(key[1], {}), "day_schedules": value}
+    elif kind == "summer_mode":
+        data["controller"].summer_mode = value
+    elif kind == "summer_mode_assignment":
+        if value:
+            data["controller"].summer_mode_assignments |= 1 << key[1]
+        else:
+            data["controller"].summer_mode_assignments &= ~(1 << key[1])
+    elif kind == "low_mode":
+        data["controller"].low_mode["enabled"] = value
+
+
+class BmrControllerState:
+    """ Snapshot of the controller-wide state. These values are the same for
+        all circuits so they are read once (in the slow tier) and shared by
+        all climate and switch entities.
+
+        Summer mode assignments are a bit mask, bit N is set when circuit N
+        is assigned (see assignments.py).
+    """
+
+    def __init__(self, low_mode=None, summer_mode=None, summer_mode_assignments=0):
+        self.low_mode = low_mode or {}
+        self.summer_mode = summer_mode
+        self.summer_mode_assignments = summer_mode_assignments
+
+    def __eq__(self, other):
+        if not isinstance(other, BmrControllerState):
+            return NotImplemented
+        return (self.low_mode, self.summer_mode, self.summer_mode_assignments) == (
+            other.low_mode,
+            other.summer_mode,
+            other.summer_mode_assignments,
+        )
+
+    def copy(self):
+        """ Return a copy which can be modified without affecting this
+            snapshot.
+        """
+        return BmrControllerState(dict(self.low_mode), self.summer_mode, self.summer_mode_assignments)
+
+    def is_circuit_off(self, circuit_id):
+        """ Return True if the circuit is turned off, i.e. it is assigned to
+            summer mode and the summer mode is on.
+        """
+        return bool(self.summer_mode and self.summer_mode_assignments >> circuit_id & 1)
+
+    def are_circuits_off(self, mask):
+        """ Return True if all the circuits in the mask are turned off.
+        """
+        return bool(self.summer_mode) and self.summer_mode_assignments & mask == mask
@@ -1,115 +1,285 @@
-"""Support for BMR shutter blinds - shutters etc."""
-
-# from pyoverkiz.enums import OverkizCommand, UIClass
-
-# from homeassistant.config_entries import ConfigEntry
-# from homeassistant.const import Platform
-# from homeassistant.core import HomeAssistant
-# from homeassistant.helpers.entity_platform import AddEntitiesCallback
-
-# from . import HomeAssistantOverkizData
-# from .const import DOMAIN
-# from .cover_entities.awning import Awning
-# from .cover_entities.generic_cover import OverkizGenericCover
-# from .cover_entities.vertical_cover import LowSpeedCover, VerticalCover
-
-
-from homeassistant.components.cover import CoverEntity
-
-async def async_setup_entry(
-    hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback
-) -> None:
-    """Set up the BMR covers from a config entry."""
-    data: HomeAssistantOverkizData = hass.data[DOMAIN][entry.entry_id]
-
-    entities: list[BmrCover] = [
-        VerticalCover(device.device_url, data.coordinator)
-        for device in data.platforms[Platform.COVER]
-        if device.ui_class != UIClass.AWNING
-    ]
-
-    async_add_entities(entities)
-
-
-
-    CoverEntityFeature = OPEN | CLOSE | SET_POSITION | OPEN_TILT | CLOSE_TILT | SET_TILT_POSITION
-    current_cover_position:int|None = None
-    current_cover_tilt_position:int|None = None
-    is_closed:bool|None = False  # Required
-    klas = CoverDeviceClass.SHUTTER
-    stejts = STATE_OPEN, STATE_CLOSED
-
-    def update():
-        pass
-    
-    def async_update():
-        pass
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def open_cover(self, **kwargs):
-        """Open the cover."""
+"""
+Support for BMR HC64 roller shutters.
+
+configuration.yaml
+
+cover:
+  - platform: bmr_hc64
+    base_url: http://ip-address/
+    username: user
+    password: password
+    shutters:
+      - name: "Kitchen"
+        shutter: 0
+        travel_time:
+          seconds: 25
+
+      - name: "Terrace"
+        shutter: 2
+"""
+
+import logging
+import time
+from datetime import timedelta
+
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
+from homeassistant.components.cover import (
+    ATTR_POSITION,
+    ATTR_TILT_POSITION,
+    PLATFORM_SCHEMA,
+    CoverDeviceClass,
+    CoverEntity,
+    CoverEntityFeature,
+)
+from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+
+from .client import SHUTTER_POSITIONS, SHUTTER_TILT_STEPS, bmr_shutter_position, bmr_shutter_tilt
+from .const import CONF_BASE_URL, SHUTTER_SETTLE_DELAY, SHUTTER_TRAVEL_TIME
+from .coordinator import CONTROLLER_SCHEMA, async_get_coordinator
+from .entity import BmrEntity
+
+_LOGGER = logging.getLogger(__name__)
+CONF_SHUTTERS = "shutters"
+CONF_NAME = "name"
+CONF_SHUTTER_ID = "shutter"
+CONF_TRAVEL_TIME = "travel_time"
+CONF_SHUTTER = vol.Schema(
+    {
+        vol.Required(CONF_NAME): cv.string,
+        vol.Required(CONF_SHUTTER_ID): vol.All(vol.Coerce(int), vol.Range(min=0, max=32)),
+        vol.Optional(CONF_TRAVEL_TIME, default=SHUTTER_TRAVEL_TIME): cv.positive_time_period,
+    }
+)
+
+PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
+    {
+        vol.Required(CONF_BASE_URL): cv.string,
+        vol.Required(CONF_USERNAME): cv.string,
+        vol.Required(CONF_PASSWORD): cv.string,
+        **CONTROLLER_SCHEMA,
+        vol.Required(CONF_SHUTTERS): vol.All(cv.ensure_list, [CONF_SHUTTER]),
+    }
+)
+
+# How often to update the estimated position of a moving shutter.
+MOTION_UPDATE_INTERVAL = timedelta(seconds=1)
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    coordinator = await async_get_coordinator(hass, config)
+    covers = []
+    for config_shutter in config.get(CONF_SHUTTERS):
+        coordinator.track_shutter(config_shutter.get(CONF_SHUTTER_ID))
+        covers.append(BmrShutter(coordinator, config_shutter))
+
+    async_add_entities(covers)
+    coordinator.async_schedule_refresh()
+
+
+class BmrShutter(BmrEntity, CoverEntity):
+    """ Roller shutter connected to the controller.
+
+        The controller moves a shutter to one of four positions only (see
+        SHUTTER_POSITIONS) and reading it while it moves is useless and slow.
+        After a command the position is estimated from the travel time of
+        the shutter and the shutter is read once when the motion should be
+        over.
+    """
+
+    _attr_device_class = CoverDeviceClass.SHUTTER
+    _attr_supported_features = (
+        CoverEntityFeature.OPEN
+        | CoverEntityFeature.CLOSE
+        | CoverEntityFeature.SET_POSITION
+        | CoverEntityFeature.OPEN_TILT
+        | CoverEntityFeature.CLOSE_TILT
+        | CoverEntityFeature.SET_TILT_POSITION
+    )
+
+    def __init__(self, coordinator, config):
+        super().__init__(coordinator)
+        self._config = config
+        self._shutter_id = config.get(CONF_SHUTTER_ID)
+        self._travel_time = config.get(CONF_TRAVEL_TIME).total_seconds()
+        self._snapshot_keys = [("shutter", self._shutter_id)]
+        self._shutter = None
+
+        # Current motion: (start position, target position, start time,
+        # duration) and the timers driving it. The motion is kept (at its
+        # target) until the shutter is read after it ended.
+        self._motion = None
+        self._tilt = None
+        self._unsub_motion_update = None
+        self._unsub_motion_end = None
+
+        self._unique_id = f"{coordinator.unique_id}-cover-{self._shutter_id}"
+
+    @property
+    def name(self):
+        """ Return the name of the entity.
+        """
+        return self._config.get(CONF_NAME)
+
+    @property
+    def unique_id(self):
+        """ Return unique ID of the entity.
+        """
+        return self._unique_id
+
+    @property
+    def current_cover_position(self):
+        """ Return the position of the shutter, estimated while it moves.
+        """
+        if self._motion is not None:
+            start, target, started, duration = self._motion
+            progress = min((time.monotonic() - started) / duration, 1.0) if duration else 1.0
+            return round(start + (target - start) * progress)
+        if self._shutter is None:
+            return None
+        return SHUTTER_POSITIONS.get(self._shutter["pos"])
+
+    @property
+    def current_cover_tilt_position(self):
+        """ Return the tilt of the slats, 100 is open.
+        """
+        if self._tilt is not None:
+            return self._tilt
+        if self._shutter is None:
+            return None
+        return 100 - min(self._shutter["tilt"], SHUTTER_TILT_STEPS) * 100 // SHUTTER_TILT_STEPS
+
+    @property
+    def is_closed(self):
+        position = self.current_cover_position
+        return None if position is None else position == 0
+
+    @property
+    def is_opening(self):
+        return self._is_moving() and self._motion[1] > self._motion[0]
+
+    @property
+    def is_closing(self):
+        return self._is_moving() and self._motion[1] < self._motion[0]
+
+    def _is_moving(self):
+        """ Return True if the shutter should still be moving.
+        """
+        if self._motion is None:
+            return False
+        _, _, started, duration = self._motion
+        return time.monotonic() - started < duration
 
     async def async_open_cover(self, **kwargs):
-        """Open the cover."""
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def close_cover(self, **kwargs):
-        """Close cover."""
+        """ Open the shutter.
+        """
+        await self._async_move(100, self.current_cover_tilt_position)
 
     async def async_close_cover(self, **kwargs):
-        """Close cover."""
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def set_cover_position(self, **kwargs):
-        """Move the cover to a specific position."""
+        """ Close the shutter.
+        """
+        await self._async_move(0, self.current_cover_tilt_position)
 
     async def async_set_cover_position(self, **kwargs):
-        """Move the cover to a specific position."""
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def open_cover_tilt(self, **kwargs):
-        """Open the cover tilt."""
+        """ Move the shutter to the nearest position the controller supports.
+        """
+        await self._async_move(kwargs[ATTR_POSITION], self.current_cover_tilt_position)
 
     async def async_open_cover_tilt(self, **kwargs):
-        """Open the cover tilt."""
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def close_cover_tilt(self, **kwargs):
-        """Close the cover tilt."""
+        """ Open the slats.
+        """
+        await self._async_move(self._target_position(), 100)
 
     async def async_close_cover_tilt(self, **kwargs):
-        """Close the cover tilt."""
-
-class BmrCover(CoverEntity):
-    # Implement one of these methods.
-
-    def set_cover_tilt_position(self, **kwargs):
-        """Move the cover tilt to a specific position."""
+        """ Close the slats.
+        """
+        await self._async_move(self._target_position(), 0)
 
     async def async_set_cover_tilt_position(self, **kwargs):
-        """Move the cover tilt to a specific position."""
-
+        """ Set tilt of the slats.
+        """
+        await self._async_move(self._target_position(), kwargs[ATTR_TILT_POSITION])
+
+    def _target_position(self):
+        """ Return the position the shutter is at or moving to.
+        """
+        if self._motion is not None:
+            return self._motion[1]
+        position = self.current_cover_position
+        return 100 if position is None else position
+
+    async def _async_move(self, position, tilt):
+        """ Send the command and start estimating the position.
+        """
+        tilt = 100 if tilt is None else tilt
+        target = SHUTTER_POSITIONS[bmr_shutter_position(position)]
+        start = self.current_cover_position
+        if start is None:
+            start = target
+        if not await self.coordinator.async_move_shutter(self._shutter_id, position, tilt):
+            raise HomeAssistantError(f"BMR HC64 controller refused to move roller shutter {self._shutter_id}")
+
+        self._cancel_motion()
+        duration = abs(target - start) / 100 * self._travel_time
+        self._motion = (start, target, time.monotonic(), duration)
+        self._tilt = 100 - bmr_shutter_tilt(tilt) * 100 // SHUTTER_TILT_STEPS
+        if duration:
+            self._unsub_motion_update = async_track_time_interval(
+                self.hass, self._async_update_motion, MOTION_UPDATE_INTERVAL
+            )
+        self._unsub_motion_end = async_call_later(
+            self.hass, duration + SHUTTER_SETTLE_DELAY.total_seconds(), self._async_end_motion
+        )
+        self.async_write_ha_state()
+
+    @callback
+    def _async_update_motion(self, now):
+        """ Publish the estimated position of the moving shutter.
+        """
+        if not self._is_moving() and self._unsub_motion_update is not None:
+            self._unsub_motion_update()
+            self._unsub_motion_update = None
+        self.async_write_ha_state()
+
+    async def _async_end_motion(self, now):
+        """ The shutter should have stopped, read where it really is. If the
+            read fails the estimated position stays until the next refresh.
+        """
+        self._unsub_motion_end = None
+        self._cancel_motion()
+        self.async_write_ha_state()
+        await self.coordinator.async_confirm_shutter(self._shutter_id)
+
+    def _cancel_motion(self):
+        if self._unsub_motion_update is not None:
+            self._unsub_motion_update()
+            self._unsub_motion_update = None
+        if self._unsub_motion_end is not None:
+            self._unsub_motion_end()
+            self._unsub_motion_end = None
+
+    async def async_will_remove_from_hass(self):
+        self._cancel_motion()
+        await super().async_will_remove_from_hass()
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the shutter state from the latest snapshot fetched by the
+            coordinator.
+        """
+        if self.coordinator.data:
+            self._shutter = self.coordinator.data["shutters"].get(self._shutter_id)
+        if (
+            self._motion is not None
+            and self._unsub_motion_end is None
+            and not self.coordinator.is_shutter_moving(self._shutter_id)
+        ):
+            # First data after the motion ended.
+            self._motion = None
+            self._tilt = None
+            self.async_write_ha_state()
+            return
+        super()._handle_coordinator_update()
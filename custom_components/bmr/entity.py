@@ -0,0 +1,74 @@
+"""
+Base class for BMR HC64 entities.
+"""
+
+from homeassistant.core import callback
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
+
+
+class BmrEntity(CoordinatorEntity):
+    """ Entity taking its state from the shared controller coordinator.
+
+        The state is written only when it actually changed. Entities list the
+        parts of the snapshot their state depends on in `_snapshot_keys` (see
+        BmrCoordinator.changed), None means the whole snapshot. Entities whose
+        parts didn't change in the update are skipped right away, the others
+        compare their state and attributes with the last written ones.
+
+        Right after a restart the state comes from the snapshot saved by the
+        coordinator and is reported as assumed until the first refresh. The
+        state is assumed as well while its parts of the snapshot can't be
+        read, after FAILED_READ_TIMEOUT the entity becomes unavailable.
+    """
+
+    _snapshot_keys = None
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self._published = None
+
+    async def async_added_to_hass(self):
+        """ Take the state from the snapshot the coordinator already has (if
+            any) instead of waiting for the next refresh.
+        """
+        await super().async_added_to_hass()
+        if self.coordinator.data:
+            self._handle_coordinator_update()
+
+    @callback
+    def _handle_coordinator_update(self):
+        """ Write the state if it changed. Subclasses take their data from the
+            snapshot first and then call this.
+        """
+        if (
+            self._published is not None
+            and self._published[0] == self.available
+            and not self.coordinator.has_changed(self._snapshot_keys)
+        ):
+            return
+        if self._published_state() != self._published:
+            self.async_write_ha_state()
+
+    @callback
+    def async_write_ha_state(self):
+        """ Write the state and remember what was written.
+        """
+        self._published = self._published_state()
+        super().async_write_ha_state()
+
+    @property
+    def available(self):
+        """ The entity is unavailable when its parts of the snapshot couldn't
+            be read for too long.
+        """
+        return super().available and not self.coordinator.has_failed(self._snapshot_keys)
+
+    @property
+    def assumed_state(self):
+        """ The state is assumed while it comes from the snapshot saved
+            before Home Assistant was restarted or from an older read.
+        """
+        return self.coordinator.stale or self.coordinator.is_failing(self._snapshot_keys)
+
+    def _published_state(self):
+        return (self.available, self.assumed_state, self.state, self.state_attributes, self.extra_state_attributes)
@@ -0,0 +1,121 @@
+"""
+Streaming outlier filters for circuit temperatures.
+
+The HC64 controller sometimes reports temperatures which are obviously wrong
+(e.g. when it is reloading its configuration). Each circuit gets one filter
+which is fed every sample exactly once per coordinator cycle, the filtered
+value is then shared by all entities of the circuit. All filters keep a fixed
+number of recent samples in a ring buffer, so the work per sample and the
+memory used are constant.
+"""
+
+from .buffers import RingBuffer
+
+FILTER_NONE = "none"
+FILTER_RATE_LIMIT = "rate_limit"
+FILTER_MEDIAN = "median"
+FILTER_HAMPEL = "hampel"
+FILTERS = [FILTER_NONE, FILTER_RATE_LIMIT, FILTER_MEDIAN, FILTER_HAMPEL]
+
+DEFAULT_FILTER = FILTER_RATE_LIMIT
+DEFAULT_WINDOW = 5
+
+# Max difference between two subsequent temperature measurements.
+MAX_TEMPERATURE_DELTA = 5.0
+
+# How many subsequent samples the rate limit filter rejects before it accepts
+# the new value, so that a real change doesn't freeze the sensor forever.
+MAX_REJECTED_SAMPLES = 3
+
+# Hampel filter: samples further than HAMPEL_THRESHOLD standard deviations
+# from the median are outliers. The deviation is estimated from the median
+# absolute deviation (MAD), but never considered lower than MIN_DEVIATION
+# degrees so that the usual 0.1 degree noise isn't treated as an outlier.
+HAMPEL_THRESHOLD = 3.0
+MAD_SCALE = 1.4826
+MIN_DEVIATION = 0.5
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def create_filter(name=DEFAULT_FILTER, window=DEFAULT_WINDOW):
+    """ Create a new filter instance for one circuit.
+    """
+    if name == FILTER_RATE_LIMIT:
+        return RateLimitFilter()
+    elif name == FILTER_MEDIAN:
+        return RollingMedianFilter(window)
+    elif name == FILTER_HAMPEL:
+        return HampelFilter(window)
+    else:
+        return PassThroughFilter()
+
+
+class PassThroughFilter:
+    """ Filter which doesn't filter anything.
+    """
+
+    def update(self, value):
+        return value
+
+
+class RateLimitFilter:
+    """ Reject samples which differ from the last accepted sample by
+        `max_delta` or more and report the last accepted value instead. After
+        `max_rejected` subsequent rejections the new value is accepted.
+    """
+
+    def __init__(self, max_delta=MAX_TEMPERATURE_DELTA, max_rejected=MAX_REJECTED_SAMPLES):
+        self._max_delta = max_delta
+        self._max_rejected = max_rejected
+        self._last = None
+        self._rejected = 0
+
+    def update(self, value):
+        if self._last is not None and abs(value - self._last) >= self._max_delta:
+            self._rejected += 1
+            if self._rejected <= self._max_rejected:
+                return self._last
+        self._last = value
+        self._rejected = 0
+        return value
+
+
+class RollingMedianFilter:
+    """ Report the median of the last `window` samples.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._samples = RingBuffer(window)
+
+    def update(self, value):
+        self._samples.append(value)
+        return _median(self._samples.values())
+
+
+class HampelFilter:
+    """ Replace samples too far from the median of the last `window` samples
+        with the median. Unlike the rolling median, samples which are not
+        outliers are reported unchanged.
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, threshold=HAMPEL_THRESHOLD):
+        self._samples = RingBuffer(window)
+        self._threshold = threshold
+
+    def update(self, value):
+        self._samples.append(value)
+        values = self._samples.values()
+        if len(values) < 3:
+            return value
+        median = _median(values)
+        deviation = max(MAD_SCALE * _median([abs(x - median) for x in values]), MIN_DEVIATION)
+        if abs(value - median) > self._threshold * deviation:
+            return median
+        return value
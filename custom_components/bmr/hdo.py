@@ -0,0 +1,103 @@
+"""
+Learned timetable of the HDO (low/high electricity tariff) signal.
+
+The distributor switches the tariff according to a fixed daily timetable, so
+there is no point in asking the controller every update cycle. Every change
+of the signal seen by the integration is an observed switching time (edge).
+Edges observed at about the same time of day are merged, an edge seen on at
+least MIN_OBSERVATIONS days is used to predict the next switch.
+"""
+
+from datetime import timedelta
+
+# Edges of the same direction closer than this (in minutes) are the same
+# switching time of the timetable.
+EDGE_TOLERANCE = 15
+
+# How many times an edge must be observed before it is used for predictions.
+MIN_OBSERVATIONS = 2
+
+# Edges not observed for this many days are forgotten (the timetable was
+# changed).
+MAX_AGE = 8
+
+# Changes of the signal are learned only when the time of the switch is
+# known at least this precisely, i.e. the observations before and after
+# the change aren't further apart.
+MAX_EDGE_UNCERTAINTY = timedelta(minutes=30)
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class BmrHdoTimetable:
+    """ Switching times of the HDO signal learned from observations.
+    """
+
+    def __init__(self):
+        # Learned edges: {"minute": minute of the day, "state": the new state,
+        # "count": number of observations, "last_seen": ordinal of the day}
+        self.edges = []
+        self._last = None
+
+    def observe(self, when, state):
+        """ Record the state of the signal at the time (an aware datetime).
+            Return True if an edge was learned.
+        """
+        last, self._last = self._last, (when, state)
+        if last is None or last[1] == state or when - last[0] > MAX_EDGE_UNCERTAINTY:
+            return False
+        self._learn(last[0] + (when - last[0]) / 2, state)
+        return True
+
+    def _learn(self, when, state):
+        minute = when.hour * 60 + when.minute + when.second / 60
+        day = when.date().toordinal()
+        self.edges = [edge for edge in self.edges if day - edge["last_seen"] <= MAX_AGE]
+        for edge in self.edges:
+            delta = _minutes_between(edge["minute"], minute)
+            if edge["state"] == state and abs(delta) <= EDGE_TOLERANCE:
+                # Running mean, recent observations weigh more once the edge
+                # is well known.
+                edge["count"] += 1
+                edge["minute"] = (edge["minute"] + delta / min(edge["count"], 10)) % MINUTES_PER_DAY
+                edge["last_seen"] = day
+                return
+        self.edges.append({"minute": minute, "state": state, "count": 1, "last_seen": day})
+
+    def predict(self, when, lookback=timedelta()):
+        """ Return (time, new state) of the next learned switch away from the
+            last observed state, or None if nothing usable was learned yet.
+            Switches expected up to `lookback` ago count as next ones, they
+            may be late.
+        """
+        if self._last is None:
+            return None
+        state = self._last[1]
+        since = when - lookback
+        midnight = since.replace(hour=0, minute=0, second=0, microsecond=0)
+        prediction = None
+        for edge in self.edges:
+            if edge["state"] == state or edge["count"] < MIN_OBSERVATIONS:
+                continue
+            expected = midnight + timedelta(minutes=edge["minute"])
+            if expected < since:
+                expected += timedelta(days=1)
+            if prediction is None or expected < prediction[0]:
+                prediction = (expected, edge["state"])
+        return prediction
+
+    def as_dict(self):
+        return {"edges": self.edges}
+
+    @classmethod
+    def from_dict(cls, data):
+        timetable = cls()
+        timetable.edges = [dict(edge) for edge in data.get("edges", [])]
+        return timetable
+
+
+def _minutes_between(start, end):
+    """ Return the shortest signed distance from `start` to `end` (minutes of
+        the day), across midnight if shorter.
+    """
+    return (end - start + MINUTES_PER_DAY / 2) % MINUTES_PER_DAY - MINUTES_PER_DAY / 2
@@ -0,0 +1,71 @@
+"""
+In-memory history of circuit readings.
+
+The coordinator appends every circuit reading to a per-circuit history so
+automations can get recent temperatures without querying the recorder
+database. The samples are stored column-wise in fixed-size ring buffers, a
+few bytes per sample instead of a dict per sample.
+"""
+
+import bisect
+import math
+
+from .buffers import RingBuffer
+
+# How many samples to keep per circuit. With the default refresh interval of
+# 30 seconds this is 24 hours.
+HISTORY_SIZE = 2880
+
+
+class BmrCircuitHistory:
+    """ Timestamped temperature, target temperature and heating samples of
+        one circuit.
+    """
+
+    def __init__(self, capacity=HISTORY_SIZE):
+        self._timestamps = RingBuffer(capacity)
+        self._temperatures = RingBuffer(capacity)
+        self._target_temperatures = RingBuffer(capacity)
+        self._heating = RingBuffer(capacity, typecode="b")
+
+    def __len__(self):
+        return len(self._timestamps)
+
+    def append(self, timestamp, circuit):
+        """ Append a sample taken from the result of getCircuit(). Missing
+            temperatures are stored as NaN.
+        """
+        if len(self._timestamps) and timestamp <= self._timestamps.last():
+            return
+        self._timestamps.append(timestamp)
+        self._temperatures.append(_to_float(circuit.get("temperature")))
+        self._target_temperatures.append(_to_float(circuit.get("target_temperature")))
+        self._heating.append(bool(circuit.get("heating")))
+
+    def window(self, since=None):
+        """ Return samples taken at `since` (UNIX timestamp) or later, as a
+            dict of columns.
+        """
+        timestamps = self._timestamps.values()
+        start = bisect.bisect_left(timestamps, since) if since is not None else 0
+        return {
+            "timestamps": timestamps[start:].tolist(),
+            "temperature": [_from_float(value) for value in self._temperatures.values()[start:]],
+            "target_temperature": [_from_float(value) for value in self._target_temperatures.values()[start:]],
+            "heating": [bool(value) for value in self._heating.values()[start:]],
+        }
+
+    def columns(self):
+        """ Return the timestamps, temperatures (NaN if missing) and heating
+            flags as arrays (see `array`), from the oldest sample to the
+            newest. Meant for numeric processing, no conversions are done.
+        """
+        return self._timestamps.values(), self._temperatures.values(), self._heating.values()
+
+
+def _to_float(value):
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value):
+    return None if math.isnan(value) else value
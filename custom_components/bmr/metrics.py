@@ -0,0 +1,116 @@
+"""
+Request metrics of the BMR HC64 controller.
+
+Every HTTP request sent to the controller is recorded under the name of the
+client operation it belongs to (getCircuit, setSchedule, ...): the number of
+requests, errors and timeouts and a histogram of latencies. This shows which
+calls load the controller when it gets sluggish.
+"""
+
+import asyncio
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the latency histogram buckets. The last bucket
+# counts everything slower.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class BmrOperationMetrics:
+    """ Counters of one operation.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def record(self, latency):
+        """ Record latency of an answered request.
+        """
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                break
+        else:
+            idx = len(LATENCY_BUCKETS)
+        self.histogram[idx] += 1
+
+    @property
+    def latency_mean(self):
+        """ Mean latency of answered requests (timeouts are not included).
+        """
+        answered = self.requests - self.timeouts
+        return self.latency_total / answered if answered else None
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "latency_mean": self.latency_mean,
+            "latency_max": self.latency_max,
+            "latency_histogram": {
+                **{f"le_{bound:g}": count for bound, count in zip(LATENCY_BUCKETS, self.histogram)},
+                "inf": self.histogram[-1],
+            },
+        }
+
+
+class BmrMetrics:
+    """ Metrics of all operations of one controller.
+    """
+
+    def __init__(self):
+        self.operations = {}
+
+    @contextmanager
+    def measure(self, operation):
+        """ Measure the request(s) done in the body of the with statement.
+        """
+        metrics = self.operations.get(operation)
+        if metrics is None:
+            metrics = self.operations[operation] = BmrOperationMetrics()
+        start = time.monotonic()
+        try:
+            yield
+        except asyncio.TimeoutError:
+            metrics.requests += 1
+            metrics.timeouts += 1
+            raise
+        except Exception:
+            metrics.requests += 1
+            metrics.errors += 1
+            metrics.record(time.monotonic() - start)
+            raise
+        else:
+            metrics.requests += 1
+            metrics.record(time.monotonic() - start)
+
+    @property
+    def requests(self):
+        return sum(metrics.requests for metrics in self.operations.values())
+
+    @property
+    def errors(self):
+        return sum(metrics.errors for metrics in self.operations.values())
+
+    @property
+    def timeouts(self):
+        return sum(metrics.timeouts for metrics in self.operations.values())
+
+    @property
+    def latency_mean(self):
+        """ Mean latency of answered requests of all operations.
+        """
+        answered = self.requests - self.timeouts
+        if not answered:
+            return None
+        return sum(metrics.latency_total for metrics in self.operations.values()) / answered
+
+    def as_dict(self):
+        return {operation: metrics.as_dict() for operation, metrics in sorted(self.operations.items())}
@@ -0,0 +1,150 @@
+"""
+Heating and cooling runtime of circuits over rolling windows.
+
+Every update cycle tells whether a circuit is heating or cooling. The time
+between two cycles is accounted to the state seen at the start of it, in
+buckets of fixed length. A window keeps a fixed number of buckets and the
+running totals of them: when a bucket falls out of the window its content is
+subtracted from the totals, so both memory and work per update are constant
+no matter how long the window is.
+"""
+
+from array import array
+from datetime import timedelta
+
+# Rolling windows: name -> (length, number of buckets). The oldest bucket may
+# be partially out of the window, i.e. the precision is one bucket.
+WINDOWS = {
+    "1h": (timedelta(hours=1), 60),
+    "24h": (timedelta(hours=24), 96),
+    "7d": (timedelta(days=7), 168),
+}
+
+# Samples further apart than this (controller unreachable, Home Assistant
+# stopped) leave a gap, the time in between isn't accounted at all.
+MAX_SAMPLE_GAP = 300  # seconds
+
+
+class BmrRollingWindow:
+    """ Heating, cooling and observed time (in seconds) over a rolling
+        window.
+    """
+
+    def __init__(self, length, buckets):
+        self.bucket_length = length.total_seconds() / buckets
+        self._size = buckets
+        self._heating = array("d", bytes(8 * buckets))
+        self._cooling = array("d", bytes(8 * buckets))
+        self._observed = array("d", bytes(8 * buckets))
+        # Number of the newest bucket (seconds since epoch / bucket length)
+        self._newest = None
+
+        self.heating = 0.0
+        self.cooling = 0.0
+        self.observed = 0.0
+
+    def add(self, start, end, heating, cooling):
+        """ Account the time from `start` to `end` (timestamps).
+        """
+        while start < end:
+            bucket = int(start // self.bucket_length)
+            until = min(end, (bucket + 1) * self.bucket_length)
+            self._add_to_bucket(bucket, until - start, heating, cooling)
+            start = until
+
+    def advance(self, timestamp):
+        """ Drop buckets which fell out of the window by `timestamp`.
+        """
+        self._advance(int(timestamp // self.bucket_length))
+
+    def _advance(self, bucket):
+        if self._newest is None:
+            self._newest = bucket
+            return
+        if bucket <= self._newest:
+            return
+        for expired in range(self._newest + 1, min(bucket, self._newest + self._size) + 1):
+            slot = expired % self._size
+            self.heating -= self._heating[slot]
+            self.cooling -= self._cooling[slot]
+            self.observed -= self._observed[slot]
+            self._heating[slot] = self._cooling[slot] = self._observed[slot] = 0.0
+        self._newest = bucket
+        # Keep rounding errors from accumulating in the totals.
+        self.heating = max(self.heating, 0.0)
+        self.cooling = max(self.cooling, 0.0)
+        self.observed = max(self.observed, 0.0)
+
+    def _add_to_bucket(self, bucket, duration, heating, cooling):
+        self._advance(bucket)
+        if bucket <= self._newest - self._size:
+            return
+        slot = bucket % self._size
+        self._observed[slot] += duration
+        self.observed += duration
+        if heating:
+            self._heating[slot] += duration
+            self.heating += duration
+        if cooling:
+            self._cooling[slot] += duration
+            self.cooling += duration
+
+    def duty_cycle(self, seconds):
+        """ Return share (in percent) of the observed time, None if nothing
+            was observed.
+        """
+        return seconds / self.observed * 100 if self.observed else None
+
+    def as_dict(self):
+        return {
+            "newest": self._newest,
+            "heating": self._heating.tolist(),
+            "cooling": self._cooling.tolist(),
+            "observed": self._observed.tolist(),
+        }
+
+    def restore(self, data):
+        """ Restore content saved by as_dict(). Ignored if the number of
+            buckets doesn't match.
+        """
+        if any(len(data[key]) != self._size for key in ("heating", "cooling", "observed")):
+            return
+        self._newest = data["newest"]
+        self._heating = array("d", data["heating"])
+        self._cooling = array("d", data["cooling"])
+        self._observed = array("d", data["observed"])
+        self.heating = sum(self._heating)
+        self.cooling = sum(self._cooling)
+        self.observed = sum(self._observed)
+
+
+class BmrCircuitRuntime:
+    """ Rolling windows (see WINDOWS) of one circuit.
+    """
+
+    def __init__(self):
+        self.windows = {name: BmrRollingWindow(length, buckets) for name, (length, buckets) in WINDOWS.items()}
+        self._last = None
+
+    def update(self, timestamp, circuit):
+        """ Account the time since the previous sample to the state of the
+            circuit seen then and remember the current state.
+        """
+        last, self._last = self._last, (timestamp, bool(circuit.get("heating")), bool(circuit.get("cooling")))
+        if last is not None and 0 < timestamp - last[0] <= MAX_SAMPLE_GAP:
+            for window in self.windows.values():
+                window.add(last[0], timestamp, last[1], last[2])
+        for window in self.windows.values():
+            window.advance(timestamp)
+
+    def as_dict(self):
+        return {"last": self._last, "windows": {name: window.as_dict() for name, window in self.windows.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        runtime = cls()
+        runtime._last = tuple(data["last"]) if data.get("last") else None
+        for name, window in data.get("windows", {}).items():
+            if name in runtime.windows:
+                runtime.windows[name].restore(window)
+        return runtime
@@ -0,0 +1,125 @@
+"""
+Request scheduler for the BMR HC64 controller.
+
+The embedded web server of the HC64 degrades badly when it receives
+concurrent requests. All requests to one controller therefore go through a
+single BmrRequestScheduler which limits the number of requests in flight,
+runs user-initiated requests (writes) ahead of background polling and merges
+identical reads waiting in the queue.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+
+PRIORITY_USER = 0
+PRIORITY_POLL = 1
+
+DEFAULT_MAX_IN_FLIGHT = 1
+
+# Priority of requests made by the current task. Code applying user-initiated
+# changes sets this to PRIORITY_USER so the reads it needs (e.g. reading
+# summer mode assignments before modifying them) jump the queue as well.
+request_priority = contextvars.ContextVar("bmr_request_priority", default=PRIORITY_POLL)
+
+
+class _QueuedRequest:
+    """ Request waiting for a free slot.
+    """
+
+    def __init__(self, func, priority, key, future):
+        self.func = func
+        self.priority = priority
+        self.key = key
+        self.future = future
+        self.started = False
+
+
+class BmrRequestScheduler:
+    """ Run requests to the controller with at most `max_in_flight` of them
+        in flight at the same time.
+
+        Requests are started in the order of their priority (lower number
+        first) and then in the order they were submitted. Reads carry a key
+        identifying what is being read. When a read with the same key is
+        already waiting in the queue the new read doesn't queue again, it
+        waits for the queued one, which is the same request anyway.
+    """
+
+    def __init__(self, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self._configured = False
+
+        self._queue = []
+        self._queued_reads = {}
+        self._counter = itertools.count()
+        self._in_flight = 0
+
+    def configure(self, max_in_flight=None):
+        """ Set the maximum number of requests in flight. When several
+            platforms configure the same controller the lowest limit wins.
+        """
+        if max_in_flight is not None and (not self._configured or max_in_flight < self.max_in_flight):
+            self._configured = True
+            self.max_in_flight = max_in_flight
+
+    @property
+    def queued(self):
+        """ Number of requests waiting for a free slot.
+        """
+        return sum(1 for priority, _, request in self._queue if not request.started and priority == request.priority)
+
+    async def async_run(self, func, key=None, priority=None):
+        """ Queue the request and wait for its result. `func` is a coroutine
+            function sending the request. Pass `key` for reads only.
+        """
+        if priority is None:
+            priority = request_priority.get()
+
+        request = self._queued_reads.get(key) if key is not None else None
+        if request is not None:
+            if priority < request.priority:
+                # Move the queued read forward, the stale heap entry is
+                # skipped once it gets to the top.
+                request.priority = priority
+                heapq.heappush(self._queue, (priority, next(self._counter), request))
+        else:
+            request = _QueuedRequest(func, priority, key, asyncio.get_running_loop().create_future())
+            heapq.heappush(self._queue, (priority, next(self._counter), request))
+            if key is not None:
+                self._queued_reads[key] = request
+            self._dispatch()
+
+        return await asyncio.shield(request.future)
+
+    def _dispatch(self):
+        """ Start queued requests while there are free slots.
+        """
+        while self._queue and self._in_flight < self.max_in_flight:
+            priority, _, request = heapq.heappop(self._queue)
+            if request.started or priority != request.priority:
+                continue
+            request.started = True
+            if request.key is not None:
+                del self._queued_reads[request.key]
+            self._in_flight += 1
+            asyncio.get_running_loop().create_task(self._async_execute(request))
+
+    async def _async_execute(self, request):
+        """ Send the request and pass the result to everyone waiting for it.
+        """
+        try:
+            result = await request.func()
+        except asyncio.CancelledError:
+            request.future.cancel()
+            raise
+        except Exception as err:
+            request.future.set_exception(err)
+            # Don't complain about exceptions nobody retrieved.
+            request.future.exception()
+        else:
+            request.future.set_result(result)
+        finally:
+            self._in_flight -= 1
+            self._dispatch()
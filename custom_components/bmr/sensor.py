@@ -18,20 +18,31 @@ sensor:
 __version__ = "0.7"
 
 import logging
-import socket
-from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-from homeassistant.components.sensor import PLATFORM_SCHEMA
-from homeassistant.const import CONF_PASSWORD, CONF_USERNAME, UnitOfTemperature
+from homeassistant.components.sensor import PLATFORM_SCHEMA, SensorDeviceClass, SensorEntity, SensorStateClass
+from homeassistant.const import (
+    CONF_PASSWORD,
+    CONF_USERNAME,
+    PERCENTAGE,
+    EntityCategory,
+    UnitOfTemperature,
+    UnitOfTime,
+)
+from homeassistant.core import callback
 from homeassistant.helpers.entity import Entity
-from homeassistant.util import Throttle as throttle
+
+from .const import CONF_BASE_URL, CONF_DISCOVER_CIRCUITS
+from .coordinator import CONTROLLER_SCHEMA, async_get_coordinator
+from .entity import BmrEntity
+from .runtime import WINDOWS
 
 _LOGGER = logging.getLogger(__name__)
 
-CONF_BASE_URL = "base_url"
 CONF_CIRCUITS = "circuits"
+CONF_RECORD_CIRCUIT_SETTINGS = "record_circuit_settings"
+CONF_RUNTIME_SENSORS = "runtime_sensors"
 CONF_NAME = "name"
 CONF_CIRCUIT_ID = "circuit"
 CONF_CIRCUIT = vol.Schema(
@@ -46,37 +57,66 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Required(CONF_BASE_URL): cv.string,
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
-        vol.Required(CONF_CIRCUITS): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
+        **CONTROLLER_SCHEMA,
+        vol.Optional(CONF_RECORD_CIRCUIT_SETTINGS, default=True): cv.boolean,
+        vol.Optional(CONF_RUNTIME_SENSORS, default=False): cv.boolean,
+        vol.Optional(CONF_DISCOVER_CIRCUITS, default=False): cv.boolean,
+        vol.Optional(CONF_CIRCUITS, default=[]): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
     }
 )
 
-# Max difference between two subsequent temperature measurements.
-MAX_TEMPERATURE_DELTA = 5.0
-
-
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    import pybmr
-
-    base_url = config.get(CONF_BASE_URL)
-    user = config.get(CONF_USERNAME)
-    password = config.get(CONF_PASSWORD)
-
-    bmr = pybmr.Bmr(base_url, user, password)
+# Attributes which rarely change. They can be excluded from the recorder.
+CIRCUIT_SETTINGS_ATTRIBUTES = frozenset({"enabled", "user_offset", "max_offset"})
+
+# Rolling window reported as the state of the runtime sensors, the other
+# windows are in the attributes.
+RUNTIME_STATE_WINDOW = "24h"
+
+
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    coordinator = await async_get_coordinator(hass, config)
+    if config.get(CONF_RECORD_CIRCUIT_SETTINGS):
+        temperature_class, target_temperature_class = BmrCircuitTemperature, BmrCircuitTargetTemperature
+    else:
+        temperature_class = BmrCircuitTemperatureUnrecordedSettings
+        target_temperature_class = BmrCircuitTargetTemperatureUnrecordedSettings
+    circuits = list(config.get(CONF_CIRCUITS))
+    if config.get(CONF_DISCOVER_CIRCUITS):
+        configured = {x.get(CONF_CIRCUIT_ID) for x in circuits}
+        circuits += [
+            {CONF_NAME: x["name"], CONF_CIRCUIT_ID: x["circuit"]}
+            for x in await coordinator.async_discover_circuits()
+            if x["circuit"] not in configured
+        ]
     sensors = []
-    for circuit_config in config.get(CONF_CIRCUITS):
-        sensors.append(BmrCircuitTemperature(bmr, circuit_config))
-        sensors.append(BmrCircuitTargetTemperature(bmr, circuit_config))
-
-    add_entities(sensors)
-
-
-class BmrCircuitTemperatureBase(Entity):
+    for circuit_config in circuits:
+        coordinator.track_circuit(circuit_config.get(CONF_CIRCUIT_ID))
+        sensors.append(temperature_class(coordinator, circuit_config))
+        sensors.append(target_temperature_class(coordinator, circuit_config))
+        if config.get(CONF_RUNTIME_SENSORS):
+            coordinator.track_runtime(circuit_config.get(CONF_CIRCUIT_ID))
+            sensors.append(BmrCircuitDutyCycle(coordinator, circuit_config))
+            sensors.append(BmrCircuitHeatingRuntime(coordinator, circuit_config))
+    if not coordinator.metrics_sensors_added:
+        coordinator.metrics_sensors_added = True
+        sensors += [
+            BmrControllerRequests(coordinator),
+            BmrControllerRequestErrors(coordinator),
+            BmrControllerRequestLatency(coordinator),
+        ]
+
+    async_add_entities(sensors)
+    coordinator.async_schedule_refresh()
+
+
+class BmrCircuitTemperatureBase(BmrEntity, Entity):
     """ Base class for temperature reporting sensors.
     """
 
-    def __init__(self, bmr, config):
-        self._bmr = bmr
+    def __init__(self, coordinator, config):
+        super().__init__(coordinator)
         self._config = config
+        self._snapshot_keys = [("circuit", config.get(CONF_CIRCUIT_ID))]
 
         self._circuit = {}
 
@@ -87,7 +127,7 @@ class BmrCircuitTemperatureBase(Entity):
         return UnitOfTemperature.CELSIUS
 
     @property
-    def device_state_attributes(self):
+    def extra_state_attributes(self):
         return {
             "enabled": self._circuit.get("enabled"),
             "user_offset": self._circuit.get("user_offset"),
@@ -101,23 +141,20 @@ class BmrCircuitTemperatureBase(Entity):
             "target_temperature": self._circuit.get("target_temperature"),
         }
 
-    @throttle(timedelta(seconds=30))
-    def update(self):
-        """ Fetch new state data for the sensor.
-            This is the only method that should fetch new data for Home Assistant.
-        """
-        try:
-            circuit = self._bmr.getCircuit(self._config.get(CONF_CIRCUIT_ID))
-            if circuit["temperature"] is None:
-                _LOGGER.warn("BMR HC64 controller returned temperature as None, trying again later.")
-            elif self._circuit and abs(circuit["temperature"] - self._circuit["temperature"]) >= MAX_TEMPERATURE_DELTA:
-                _LOGGER.warn(
-                    "BMR HC64 controller returned temperature which is too different from the previously seen value."
-                )
-            else:
-                self._circuit = circuit
-        except socket.timeout:
-            _LOGGER.warn("Read from BMR HC64 controller timed out. Retrying later.")
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the state of the circuit from the latest snapshot fetched by
+            the coordinator.
+        """
+        data = self.coordinator.data
+        circuit = data["circuits"].get(self._config.get(CONF_CIRCUIT_ID)) if data else None
+        if circuit is None:
+            pass
+        elif circuit["temperature"] is None:
+            _LOGGER.warning("BMR HC64 controller returned temperature as None, trying again later.")
+        else:
+            self._circuit = circuit
+        super()._handle_coordinator_update()
 
 
 class BmrCircuitTemperature(BmrCircuitTemperatureBase):
@@ -126,7 +163,7 @@ class BmrCircuitTemperature(BmrCircuitTemperatureBase):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._unique_id = f"{self._bmr.getUniqueId()}-sensor-{self._config.get(CONF_CIRCUIT_ID)}-temperature"
+        self._unique_id = f"{self.coordinator.unique_id}-sensor-{self._config.get(CONF_CIRCUIT_ID)}-temperature"
 
     @property
     def name(self):
@@ -153,7 +190,7 @@ class BmrCircuitTargetTemperature(BmrCircuitTemperatureBase):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._unique_id = f"{self._bmr.getUniqueId()}-sensor-{self._config.get(CONF_CIRCUIT_ID)}-target-temperature"
+        self._unique_id = f"{self.coordinator.unique_id}-sensor-{self._config.get(CONF_CIRCUIT_ID)}-target-temperature"
 
     @property
     def name(self):
@@ -172,3 +209,238 @@ class BmrCircuitTargetTemperature(BmrCircuitTemperatureBase):
         """ Return the state of the sensor.
         """
         return self._circuit.get("target_temperature")
+
+
+class BmrCircuitTemperatureUnrecordedSettings(BmrCircuitTemperature):
+    """ BmrCircuitTemperature with circuit settings excluded from the
+        recorder.
+    """
+
+    _unrecorded_attributes = CIRCUIT_SETTINGS_ATTRIBUTES
+
+
+class BmrCircuitTargetTemperatureUnrecordedSettings(BmrCircuitTargetTemperature):
+    """ BmrCircuitTargetTemperature with circuit settings excluded from the
+        recorder.
+    """
+
+    _unrecorded_attributes = CIRCUIT_SETTINGS_ATTRIBUTES
+
+
+class BmrCircuitRuntimeBase(BmrEntity, SensorEntity):
+    """ Base class for sensors reporting how long the circuit was heating or
+        cooling over rolling windows (see runtime.WINDOWS). The coordinator
+        updates the windows every cycle, the sensors only report them.
+    """
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, coordinator, config, key):
+        super().__init__(coordinator)
+        self._config = config
+        self._circuit_id = config.get(CONF_CIRCUIT_ID)
+        self._unique_id = f"{coordinator.unique_id}-sensor-{self._circuit_id}-{key}"
+
+    @property
+    def unique_id(self):
+        """ Return unique ID of the entity.
+        """
+        return self._unique_id
+
+    def _window(self, name):
+        runtime = self.coordinator.runtime.get(self._circuit_id)
+        return runtime.windows[name] if runtime is not None else None
+
+
+class BmrCircuitDutyCycle(BmrCircuitRuntimeBase):
+    """ Share of time the circuit was heating in the last 24 hours.
+    """
+
+    _attr_native_unit_of_measurement = PERCENTAGE
+    _attr_suggested_display_precision = 1
+
+    def __init__(self, coordinator, config):
+        super().__init__(coordinator, config, "duty-cycle")
+
+    @property
+    def name(self):
+        """ Return the name of the sensor.
+        """
+        return f"BMR HC64 {self._config.get(CONF_NAME)} heating duty cycle"
+
+    @property
+    def native_value(self):
+        """ Return the state of the sensor.
+        """
+        return self._duty_cycle(RUNTIME_STATE_WINDOW, "heating")
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            f"{kind}_duty_cycle_{name}": self._duty_cycle(name, kind)
+            for kind in ("heating", "cooling")
+            for name in WINDOWS
+        }
+
+    def _duty_cycle(self, name, kind):
+        window = self._window(name)
+        if window is None:
+            return None
+        duty_cycle = window.duty_cycle(getattr(window, kind))
+        return round(duty_cycle, 1) if duty_cycle is not None else None
+
+
+class BmrCircuitHeatingRuntime(BmrCircuitRuntimeBase):
+    """ How long the circuit was heating in the last 24 hours.
+    """
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_native_unit_of_measurement = UnitOfTime.HOURS
+    _attr_suggested_display_precision = 2
+
+    def __init__(self, coordinator, config):
+        super().__init__(coordinator, config, "heating-runtime")
+
+    @property
+    def name(self):
+        """ Return the name of the sensor.
+        """
+        return f"BMR HC64 {self._config.get(CONF_NAME)} heating runtime"
+
+    @property
+    def native_value(self):
+        """ Return the state of the sensor.
+        """
+        return self._runtime(RUNTIME_STATE_WINDOW, "heating")
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            f"{kind}_runtime_{name}": self._runtime(name, kind) for kind in ("heating", "cooling") for name in WINDOWS
+        }
+
+    def _runtime(self, name, kind):
+        window = self._window(name)
+        return round(getattr(window, kind) / 3600, 2) if window is not None else None
+
+
+class BmrControllerMetricsBase(BmrEntity, SensorEntity):
+    """ Base class for diagnostic sensors reporting requests sent to the
+        controller. The metrics of a controller are shared by all platforms,
+        when several sensor platforms use the same controller only the first
+        one creates these sensors.
+    """
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, coordinator, key):
+        super().__init__(coordinator)
+        self._metrics = coordinator.client.metrics
+        self._unique_id = f"{coordinator.unique_id}-sensor-{key}"
+
+    @property
+    def unique_id(self):
+        """ Return unique ID of the entity.
+        """
+        return self._unique_id
+
+    @property
+    def assumed_state(self):
+        """ The metrics are counted locally, they are never assumed.
+        """
+        return False
+
+
+class BmrControllerRequests(BmrControllerMetricsBase):
+    """ Number of requests sent to the controller.
+    """
+
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator, "requests")
+
+    @property
+    def name(self):
+        """ Return the name of the sensor.
+        """
+        return "BMR HC64 requests"
+
+    @property
+    def native_value(self):
+        """ Return the state of the sensor.
+        """
+        return self._metrics.requests
+
+    @property
+    def extra_state_attributes(self):
+        return {operation: metrics.requests for operation, metrics in sorted(self._metrics.operations.items())}
+
+
+class BmrControllerRequestErrors(BmrControllerMetricsBase):
+    """ Number of requests which failed or timed out.
+    """
+
+    _attr_state_class = SensorStateClass.TOTAL_INCREASING
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator, "request-errors")
+
+    @property
+    def name(self):
+        """ Return the name of the sensor.
+        """
+        return "BMR HC64 request errors"
+
+    @property
+    def native_value(self):
+        """ Return the state of the sensor.
+        """
+        return self._metrics.errors + self._metrics.timeouts
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            "timeouts": self._metrics.timeouts,
+            **{
+                operation: metrics.errors + metrics.timeouts
+                for operation, metrics in sorted(self._metrics.operations.items())
+                if metrics.errors or metrics.timeouts
+            },
+        }
+
+
+class BmrControllerRequestLatency(BmrControllerMetricsBase):
+    """ Mean latency of requests answered by the controller.
+    """
+
+    _attr_device_class = SensorDeviceClass.DURATION
+    _attr_state_class = SensorStateClass.MEASUREMENT
+    _attr_native_unit_of_measurement = UnitOfTime.SECONDS
+    _attr_suggested_display_precision = 2
+
+    def __init__(self, coordinator):
+        super().__init__(coordinator, "request-latency")
+
+    @property
+    def name(self):
+        """ Return the name of the sensor.
+        """
+        return "BMR HC64 request latency"
+
+    @property
+    def native_value(self):
+        """ Return the state of the sensor.
+        """
+        return self._metrics.latency_mean
+
+    @property
+    def extra_state_attributes(self):
+        return {
+            "queued": self.coordinator.client.scheduler.queued,
+            **{
+                operation: round(metrics.latency_mean, 3)
+                for operation, metrics in sorted(self._metrics.operations.items())
+                if metrics.latency_mean is not None
+            },
+        }
@@ -0,0 +1,94 @@
+"""
+Services of the BMR HC64 integration.
+"""
+
+import time
+
+import voluptuous as vol
+from homeassistant.core import SupportsResponse, callback
+from homeassistant.exceptions import HomeAssistantError
+import homeassistant.helpers.config_validation as cv
+from homeassistant.util import dt as dt_util
+
+from .const import CONF_BASE_URL, DOMAIN
+
+SERVICE_GET_HISTORY = "get_history"
+SERVICE_GET_METRICS = "get_metrics"
+
+ATTR_CIRCUIT = "circuit"
+ATTR_DURATION = "duration"
+
+GET_HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_CIRCUIT): vol.All(vol.Coerce(int), vol.Range(min=0, max=63)),
+        vol.Optional(CONF_BASE_URL): cv.string,
+        vol.Optional(ATTR_DURATION, default={"hours": 1}): cv.time_period,
+    }
+)
+
+GET_METRICS_SCHEMA = vol.Schema({vol.Optional(CONF_BASE_URL): cv.string})
+
+
+@callback
+def async_setup_services(hass):
+    """ Register the services. Safe to call more than once.
+    """
+    if hass.services.has_service(DOMAIN, SERVICE_GET_HISTORY):
+        return
+
+    @callback
+    def async_get_history(call):
+        """ Return recent readings of the circuit kept in memory.
+        """
+        coordinator = _get_coordinator(hass, call.data.get(CONF_BASE_URL))
+        circuit_id = call.data[ATTR_CIRCUIT]
+        history = coordinator.history.get(circuit_id)
+        if history is None:
+            raise HomeAssistantError(f"Circuit {circuit_id} isn't configured or wasn't read yet")
+        window = history.window(time.time() - call.data[ATTR_DURATION].total_seconds())
+        window["timestamps"] = [dt_util.utc_from_timestamp(timestamp).isoformat() for timestamp in window["timestamps"]]
+        return {ATTR_CIRCUIT: circuit_id, **window}
+
+    @callback
+    def async_get_metrics(call):
+        """ Return request metrics of the controller(s).
+        """
+        if CONF_BASE_URL in call.data:
+            coordinators = [_get_coordinator(hass, call.data[CONF_BASE_URL])]
+        else:
+            coordinators = hass.data.get(DOMAIN, {}).get("coordinators", {}).values()
+        return {
+            coordinator.base_url: {
+                "queued": coordinator.client.scheduler.queued,
+                "breaker": coordinator.client.breaker.as_dict(),
+                "operations": coordinator.client.metrics.as_dict(),
+            }
+            for coordinator in coordinators
+        }
+
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_METRICS,
+        async_get_metrics,
+        schema=GET_METRICS_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+    hass.services.async_register(
+        DOMAIN,
+        SERVICE_GET_HISTORY,
+        async_get_history,
+        schema=GET_HISTORY_SCHEMA,
+        supports_response=SupportsResponse.ONLY,
+    )
+
+
+def _get_coordinator(hass, base_url=None):
+    """ Return coordinator of the controller. The base URL may be omitted if
+        there is only one controller.
+    """
+    coordinators = hass.data.get(DOMAIN, {}).get("coordinators", {})
+    if base_url is None and len(coordinators) == 1:
+        return next(iter(coordinators.values()))
+    if base_url not in coordinators:
+        raise HomeAssistantError(f"Unknown BMR HC64 controller {base_url}, specify `base_url` of a configured one")
+    return coordinators[base_url]
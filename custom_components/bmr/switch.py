@@ -19,18 +19,19 @@ switch:
 __version__ = "0.7"
 
 import logging
-import socket
-from datetime import timedelta
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant.components.switch import PLATFORM_SCHEMA, SwitchEntity
 from homeassistant.const import CONF_PASSWORD, CONF_USERNAME
-from homeassistant.util import Throttle as throttle
+from homeassistant.core import callback
 
-_LOGGER = logging.getLogger(__name__)
+from .assignments import circuits_mask
+from .const import CONF_BASE_URL, CONF_DISCOVER_CIRCUITS
+from .coordinator import CONTROLLER_SCHEMA, BmrControllerState, async_get_coordinator
+from .entity import BmrEntity
 
-CONF_BASE_URL = "base_url"
+_LOGGER = logging.getLogger(__name__)
 CONF_CIRCUITS = "circuits"
 CONF_NAME = "name"
 CONF_CIRCUIT_ID = "circuit"
@@ -47,39 +48,47 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Required(CONF_BASE_URL): cv.string,
         vol.Required(CONF_USERNAME): cv.string,
         vol.Required(CONF_PASSWORD): cv.string,
-        vol.Required(CONF_CIRCUITS): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
+        **CONTROLLER_SCHEMA,
+        vol.Optional(CONF_DISCOVER_CIRCUITS, default=False): cv.boolean,
+        vol.Optional(CONF_CIRCUITS, default=[]): vol.All(cv.ensure_list, [CONF_CIRCUIT]),
     }
 )
 
 
-def setup_platform(hass, config, add_entities, discovery_info=None):
-    import pybmr
-
-    base_url = config.get(CONF_BASE_URL)
-    user = config.get(CONF_USERNAME)
-    password = config.get(CONF_PASSWORD)
-
-    bmr = pybmr.Bmr(base_url, user, password)
+async def async_setup_platform(hass, config, async_add_entities, discovery_info=None):
+    coordinator = await async_get_coordinator(hass, config)
+    coordinator.track_controller_state()
+    circuits = list(config.get(CONF_CIRCUITS))
+    if config.get(CONF_DISCOVER_CIRCUITS):
+        configured = {x.get(CONF_CIRCUIT_ID) for x in circuits}
+        circuits += [
+            {CONF_NAME: x["name"], CONF_CIRCUIT_ID: x["circuit"]}
+            for x in await coordinator.async_discover_circuits()
+            if x["circuit"] not in configured
+        ]
     sensors = [
-        BmrControllerAwayMode(bmr),
-        BmrControllerPowerSwitch(bmr, config.get(CONF_CIRCUITS)),
+        BmrControllerAwayMode(coordinator),
+        BmrControllerPowerSwitch(coordinator, circuits),
     ]
 
-    add_entities(sensors)
+    async_add_entities(sensors)
+    coordinator.async_schedule_refresh()
 
 
-class BmrControllerAwayMode(SwitchEntity):
+class BmrControllerAwayMode(BmrEntity, SwitchEntity):
     """ Switch for the away mode (in HC64 called "low mode"). This is a global
         state of the controller, not specific to a particular circuit. When the
         controller is in "low mode" target temperature of all circuits is set to a
         predefined temperature and no schedules are taken into account.
     """
 
-    def __init__(self, bmr):
-        self._bmr = bmr
+    def __init__(self, coordinator):
+        super().__init__(coordinator)
+        self._snapshot_keys = [("controller",)]
+        self._writer = coordinator.writer
         self._low_mode = {}
 
-        self._unique_id = f"{self._bmr.getUniqueId()}-switch-away"
+        self._unique_id = f"{coordinator.unique_id}-switch-away"
 
     @property
     def name(self):
@@ -101,50 +110,51 @@ class BmrControllerAwayMode(SwitchEntity):
     def is_on(self):
         """ Return the state of the sensor.
         """
-        return self._low_mode.get("start_date") is not None
+        return bool(self._low_mode.get("enabled"))
 
     @property
-    def device_state_attributes(self):
+    def extra_state_attributes(self):
         return {
-            "start_date": self._low_mode.get("user_offset"),
-            "end_date": self._low_mode.get("max_offset"),
+            "start_date": self._low_mode.get("start_date"),
+            "end_date": self._low_mode.get("end_date"),
             "temperature": self._low_mode.get("temperature"),
         }
 
-    def turn_on(self):
+    async def async_turn_on(self, **kwargs):
         """ Turn on the Away mode.
         """
-        self._bmr.setLowMode(True)
+        await self._writer.async_set_low_mode(True)
 
-    def turn_off(self):
+    async def async_turn_off(self, **kwargs):
         """ Turn off the Away mode.
         """
-        self._bmr.setLowMode(False)
+        await self._writer.async_set_low_mode(False)
 
-    @throttle(timedelta(seconds=30))
-    def update(self):
-        """ Fetch new state data for the sensor.
-            This is the only method that should fetch new data for Home Assistant.
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the low mode state from the latest snapshot fetched by the
+            coordinator.
         """
-        try:
-            self._low_mode = self._bmr.getLowMode()
-        except socket.timeout:
-            _LOGGER.warn("Read from BMR HC64 controller timed out. Retrying later.")
+        if self.coordinator.data:
+            self._low_mode = self.coordinator.data["controller"].low_mode
+        super()._handle_coordinator_update()
 
 
-class BmrControllerPowerSwitch(SwitchEntity):
+class BmrControllerPowerSwitch(BmrEntity, SwitchEntity):
     """ Turn heating on/off (in HC64 called "summer mode"). This is a global
         state of the controller, not specific to a particular circuit.
     """
 
-    def __init__(self, bmr, circuits):
-        self._bmr = bmr
+    def __init__(self, coordinator, circuits):
+        super().__init__(coordinator)
+        self._snapshot_keys = [("controller",)]
+        self._writer = coordinator.writer
         self._circuits = circuits
+        self._circuits_mask = circuits_mask([x.get(CONF_CIRCUIT_ID) for x in circuits])
 
-        self._unique_id = f"{self._bmr.getUniqueId()}-switch-power"
+        self._unique_id = f"{coordinator.unique_id}-switch-power"
 
-        self._summer_mode = None
-        self._summer_mode_assignments = {}
+        self._controller = BmrControllerState()
 
     @property
     def name(self):
@@ -166,28 +176,27 @@ class BmrControllerPowerSwitch(SwitchEntity):
     def is_on(self):
         """ Return the state of the sensor.
         """
-        return not (
-            self._summer_mode and all(self._summer_mode_assignments[x.get(CONF_CIRCUIT_ID)] for x in self._circuits)
-        )
+        return not self._controller.are_circuits_off(self._circuits_mask)
 
-    def turn_on(self):
+    async def async_turn_on(self, **kwargs):
         """ Turn the power on. Which means turn the summer mode off and remove
             circuits from summer mode assignments.
         """
-        self._bmr.setSummerMode(False)
-        self._bmr.setSummerModeAssignments([x.get(CONF_CIRCUIT_ID) for x in self._circuits], False)
+        self._writer.async_set_summer_mode(False)
+        await self._writer.async_set_summer_mode_assignments([x.get(CONF_CIRCUIT_ID) for x in self._circuits], False)
 
-    def turn_off(self):
+    async def async_turn_off(self, **kwargs):
         """ Turn the power off. Which means turn the summer mode on and add
             circuits to the summer mode assignments.
         """
-        self._bmr.setSummerMode(True)
-        self._bmr.setSummerModeAssignments([x.get(CONF_CIRCUIT_ID) for x in self._circuits], True)
+        self._writer.async_set_summer_mode(True)
+        await self._writer.async_set_summer_mode_assignments([x.get(CONF_CIRCUIT_ID) for x in self._circuits], True)
 
-    @throttle(timedelta(seconds=30))
-    def update(self):
-        """ Fetch new state data for the sensor.
-            This is the only method that should fetch new data for Home Assistant.
+    @callback
+    def _handle_coordinator_update(self):
+        """ Take the summer mode state from the latest snapshot fetched by the
+            coordinator.
         """
-        self._summer_mode = self._bmr.getSummerMode()
-        self._summer_mode_assignments = self._bmr.getSummerModeAssignments()
+        if self.coordinator.data:
+            self._controller = self.coordinator.data["controller"]
+        super()._handle_coordinator_update()
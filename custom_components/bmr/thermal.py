@@ -0,0 +1,122 @@
+"""
+Thermal model of rooms for optimal-start preheating.
+
+Each circuit gets two rates fitted from its recent history (see
+BmrCircuitHistory): how fast the temperature rises while the circuit heats
+and how fast it drops while it doesn't. Both are net rates (degrees per
+hour), the heat loss while heating is already included in the heating rate.
+The rates give the latest time to start heating so that the room reaches
+the next scheduled setpoint in time.
+
+The fit runs every update cycle over the histories of all the preheated
+circuits at once: the histories are stacked into 2D arrays (one row per
+circuit) and the rates of all the rows are computed by the same few NumPy
+operations, so the cost of the fit barely grows with the number of
+circuits. NumPy is imported only once the fit is needed.
+"""
+
+import math
+from datetime import timedelta
+
+from .runtime import MAX_SAMPLE_GAP
+
+# How much heating (or idle) time the history must contain before the rate
+# is trusted.
+MIN_FIT_TIME = 1800  # seconds
+
+# Heating is never started earlier than this before the setpoint, even if
+# the room heats up very slowly.
+MAX_PREHEAT_LEAD = timedelta(hours=4)
+
+
+class BmrThermalModel:
+    """ Heating and cooling rate (degrees per hour) of one circuit, None if
+        not known yet.
+    """
+
+    def __init__(self, heating_rate=None, cooling_rate=None):
+        self.heating_rate = heating_rate
+        self.cooling_rate = cooling_rate
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, BmrThermalModel)
+            and self.heating_rate == other.heating_rate
+            and self.cooling_rate == other.cooling_rate
+        )
+
+    def __repr__(self):
+        return f"BmrThermalModel(heating_rate={self.heating_rate}, cooling_rate={self.cooling_rate})"
+
+    def preheat_lead(self, temperature, setpoint, until):
+        """ Return how long before the setpoint (timedelta) heating must
+            start to reach `setpoint` from the current `temperature`, the
+            setpoint being `until` (timedelta) away. Until heating starts
+            the room cools down at the cooling rate. Return None if the room
+            can't be heated according to the model.
+        """
+        if self.heating_rate is None or self.heating_rate <= 0:
+            return None
+        cooling_rate = self.cooling_rate or 0.0
+        hours = until.total_seconds() / 3600
+        # temperature - cooling_rate * (hours - lead) + heating_rate * lead = setpoint
+        lead = (setpoint - temperature + cooling_rate * hours) / (self.heating_rate + cooling_rate)
+        return min(timedelta(hours=max(lead, 0.0)), MAX_PREHEAT_LEAD)
+
+
+def fit_thermal_models(histories):
+    """ Fit the thermal models of the circuits, `histories` maps circuit ID
+        to BmrCircuitHistory. Return circuit ID -> BmrThermalModel.
+
+        The time between two consecutive samples is accounted to the heating
+        state seen at the first of them. The rate is the total temperature
+        change over the total time spent in the state, which is robust to
+        the coarse resolution of the readings (0.1 degree).
+    """
+    import numpy as np
+
+    circuit_ids = list(histories)
+    columns = [histories[circuit_id].columns() for circuit_id in circuit_ids]
+    width = max((len(timestamps) for timestamps, _, _ in columns), default=0)
+    if width < 2:
+        return {circuit_id: BmrThermalModel() for circuit_id in circuit_ids}
+
+    # Rows are aligned to the right, shorter histories are padded with NaN
+    # at the start which makes these intervals invalid below.
+    timestamps = np.full((len(circuit_ids), width), np.nan)
+    temperatures = np.full((len(circuit_ids), width), np.nan)
+    heating = np.zeros((len(circuit_ids), width), dtype=bool)
+    for row, (row_timestamps, row_temperatures, row_heating) in enumerate(columns):
+        if len(row_timestamps):
+            timestamps[row, width - len(row_timestamps) :] = np.frombuffer(row_timestamps, dtype=np.float64)
+            temperatures[row, width - len(row_temperatures) :] = np.frombuffer(row_temperatures, dtype=np.float64)
+            heating[row, width - len(row_heating) :] = np.frombuffer(row_heating, dtype=np.int8) != 0
+
+    with np.errstate(invalid="ignore"):
+        durations = np.diff(timestamps, axis=1)
+        changes = np.diff(temperatures, axis=1)
+        valid = (durations > 0) & (durations <= MAX_SAMPLE_GAP) & np.isfinite(changes)
+    on = valid & heating[:, :-1]
+    off = valid & ~heating[:, :-1]
+
+    heating_time = np.where(on, durations, 0.0).sum(axis=1)
+    heating_change = np.where(on, changes, 0.0).sum(axis=1)
+    idle_time = np.where(off, durations, 0.0).sum(axis=1)
+    idle_change = np.where(off, changes, 0.0).sum(axis=1)
+
+    heating_rates = np.where(
+        heating_time >= MIN_FIT_TIME, heating_change / np.maximum(heating_time, 1.0) * 3600, np.nan
+    )
+    # Rooms which warm up without heating (sun, neighbours) don't cool down
+    # at all for the purpose of preheating.
+    cooling_rates = np.where(
+        idle_time >= MIN_FIT_TIME, np.maximum(-idle_change / np.maximum(idle_time, 1.0) * 3600, 0.0), np.nan
+    )
+    return {
+        circuit_id: BmrThermalModel(_to_rate(heating_rate), _to_rate(cooling_rate))
+        for circuit_id, heating_rate, cooling_rate in zip(circuit_ids, heating_rates.tolist(), cooling_rates.tolist())
+    }
+
+
+def _to_rate(value):
+    return None if math.isnan(value) else round(value, 3)
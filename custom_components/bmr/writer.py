@@ -0,0 +1,408 @@
+"""
+Write coalescing for the BMR HC64 controller.
+
+When a scene or an automation changes many circuits at once every entity
+would otherwise send its own sequence of writes to the controller, most of
+them toggling the very same global summer mode flag. The BmrWriteBatcher
+collects all writes requested within a short window and applies them in one
+pass using the smallest possible set of controller calls. Writes of values the
+controller was recently read to hold already are skipped altogether.
+"""
+
+import asyncio
+import logging
+import math
+import time
+
+from .assignments import circuits_mask, from_mask, to_mask
+from .const import SLOW_UPDATE_INTERVAL, WRITE_BATCH_DELAY
+from .scheduler import PRIORITY_USER, request_priority
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BmrWriteBatch:
+    """ Writes collected during one coalescing window. Repeated writes of the
+        same thing are merged, the last one wins.
+    """
+
+    def __init__(self, future):
+        self.future = future
+        self.schedules = {}  # schedule ID -> (name, timetable)
+        self.circuit_schedules = {}  # circuit ID -> (day_schedules, starting_day)
+        self.summer_mode_assign = 0  # mask of circuits to add to summer mode
+        self.summer_mode_unassign = 0  # mask of circuits to remove from summer mode
+        self.summer_mode = None
+        self.low_mode = None  # (enabled, temperature)
+
+    @property
+    def empty(self):
+        """ Return True if the batch contains no writes.
+        """
+        return not (
+            self.schedules
+            or self.circuit_schedules
+            or self.summer_mode_assign
+            or self.summer_mode_unassign
+            or self.summer_mode is not None
+            or self.low_mode is not None
+        )
+
+
+class BmrWriteBatcher:
+    """ Collect writes for a short time window and send them to the controller
+        as one batch.
+
+        All methods return a future which is resolved once the batch
+        containing the write was applied, it fails if any write of the batch
+        failed. The writes which succeeded are passed to the `on_write`
+        callback as a batch either way.
+
+        The batcher remembers the values the coordinator read from the
+        controller (see update_known()) and skips writes which wouldn't change
+        them. Only values read after the last write of the same key and not
+        older than `max_age` count, the values the batcher wrote itself are
+        never trusted until they are read back: the controller may have been
+        changed from elsewhere in the meantime.
+    """
+
+    def __init__(self, hass, client, delay=WRITE_BATCH_DELAY, on_write=None):
+        self._hass = hass
+        self._client = client
+        self._delay = delay
+        self._on_write = on_write
+
+        # How long a read value is trusted (timedelta). The coordinator keeps
+        # it in line with its slow refresh interval.
+        self.max_age = SLOW_UPDATE_INTERVAL
+
+        self._batch = None
+        self._lock = asyncio.Lock()
+
+        # Values read from the controller: key -> (value, time.monotonic()
+        # the read was sent)
+        self._known = {}
+
+        # When each key was last written (time.monotonic()), infinity while
+        # the write is in progress. Values read before that are outdated.
+        self._written_at = {}
+
+    def _async_pending(self):
+        """ Return the batch collecting writes right now. Start a new one
+            (and schedule its flush) if there isn't any.
+        """
+        if self._batch is None:
+            self._batch = BmrWriteBatch(self._hass.loop.create_future())
+            self._hass.async_create_task(self._async_flush_later(self._batch))
+        return self._batch
+
+    def update_known(self, data, read_at):
+        """ Remember the values read from the controller. `data` is the
+            snapshot as polled by the coordinator, `read_at` maps the parts of
+            it read in this cycle (("schedules", circuit ID) and
+            ("controller",)) to the time the read was sent (see
+            time.monotonic()).
+
+            Parts copied from the previous snapshot and values read before
+            the last write of the same key are ignored, they may be outdated.
+        """
+
+        def update(key, value, read):
+            if read is not None and read > self._written_at.get(key, -math.inf):
+                self._known[key] = (value, read)
+
+        for circuit_id, schedules in data["schedules"].items():
+            update(
+                ("circuit_schedules", circuit_id),
+                (tuple(schedules["day_schedules"]), schedules["starting_day"]),
+                read_at.get(("schedules", circuit_id)),
+            )
+        controller = data["controller"]
+        read = read_at.get(("controller",))
+        if controller.summer_mode is not None:
+            update(("summer_mode",), controller.summer_mode, read)
+            update(("summer_mode_assignments",), controller.summer_mode_assignments, read)
+        if controller.low_mode:
+            update(("low_mode",), (controller.low_mode["enabled"], controller.low_mode["temperature"]), read)
+
+    def _get_known(self, key):
+        """ Return the value of the key read from the controller, None if it
+            wasn't read since the last write or the read is too old.
+        """
+        if key not in self._known:
+            return None
+        value, read = self._known[key]
+        if time.monotonic() - read > self.max_age.total_seconds():
+            del self._known[key]
+            return None
+        return value
+
+    def _is_known(self, key, value):
+        known = self._get_known(key)
+        return known is not None and known == value
+
+    async def _async_write(self, key, write):
+        """ Await the write of the key, a coroutine. The known value of the
+            key is forgotten, polls which read the key before the write
+            finished don't update it.
+        """
+        self._written_at[key] = math.inf
+        self._known.pop(key, None)
+        try:
+            await write
+        finally:
+            self._written_at[key] = time.monotonic()
+
+    def async_set_schedule(self, schedule_id, name, timetable):
+        """ Save schedule settings.
+        """
+        batch = self._async_pending()
+        batch.schedules[schedule_id] = (name, timetable)
+        return batch.future
+
+    def async_withdraw_schedule(self, schedule_id):
+        """ Drop the write of the schedule if the batch holding it wasn't
+            applied yet. Return True if the write was dropped.
+        """
+        return self._batch is not None and self._batch.schedules.pop(schedule_id, None) is not None
+
+    def async_set_circuit_schedules(self, circuit_id, day_schedules, starting_day=1):
+        """ Assign schedules to the circuit.
+        """
+        batch = self._async_pending()
+        batch.circuit_schedules[circuit_id] = (list(day_schedules), starting_day)
+        return batch.future
+
+    def async_set_summer_mode_assignments(self, circuit_ids, value):
+        """ Assign or remove circuits to/from summer mode.
+        """
+        batch = self._async_pending()
+        mask = circuits_mask(circuit_ids)
+        if value:
+            batch.summer_mode_assign |= mask
+            batch.summer_mode_unassign &= ~mask
+        else:
+            batch.summer_mode_unassign |= mask
+            batch.summer_mode_assign &= ~mask
+        return batch.future
+
+    def async_set_summer_mode(self, value):
+        """ Turn summer mode on or off explicitly. Without this the batch
+            decides based on the summer mode assignments: turn the summer mode
+            on if any circuit was added to it, turn it off if there are no
+            circuits assigned anymore.
+        """
+        batch = self._async_pending()
+        batch.summer_mode = value
+        return batch.future
+
+    def async_set_low_mode(self, enabled, temperature=None):
+        """ Turn low mode on or off.
+        """
+        batch = self._async_pending()
+        batch.low_mode = (enabled, temperature)
+        return batch.future
+
+    async def _async_flush_later(self, batch):
+        """ Wait for the coalescing window to close and apply the batch.
+        """
+        await asyncio.sleep(self._delay)
+        # The reads needed for applying the batch are user-initiated as well.
+        request_priority.set(PRIORITY_USER)
+        async with self._lock:
+            if self._batch is batch:
+                self._batch = None
+            try:
+                written, errors = await self._async_apply(batch)
+            except Exception as err:
+                written, errors = None, [err]
+            if written is not None and not written.empty and self._on_write is not None:
+                self._on_write(written)
+            if errors:
+                batch.future.set_exception(errors[0])
+                # Don't complain about exceptions nobody retrieved.
+                batch.future.exception()
+            else:
+                batch.future.set_result(None)
+
+    async def _async_apply(self, batch):
+        """ Send the merged writes to the controller. Skip the writes which
+            wouldn't change anything. A failed write doesn't stop the others.
+
+            Return a batch holding only the writes which succeeded (or were
+            skipped) and the list of errors of the failed ones.
+        """
+        _LOGGER.debug(
+            "Writing batch: %d schedules, %d circuit schedules, summer mode assign %#x unassign %#x",
+            len(batch.schedules),
+            len(batch.circuit_schedules),
+            batch.summer_mode_assign,
+            batch.summer_mode_unassign,
+        )
+        written = BmrWriteBatch(batch.future)
+        errors = []
+
+        def failed(key, err):
+            _LOGGER.warning("Can't write %s to BMR HC64 controller: %s", key, err)
+            errors.append(err)
+
+        async def attempt(key, write):
+            try:
+                await write
+            except Exception as err:
+                failed(key, err)
+                return False
+            return True
+
+        for schedule_id, (name, timetable) in batch.schedules.items():
+            key = ("schedule", schedule_id)
+            value = (name, tuple((item["time"], int(item["temperature"])) for item in timetable))
+            if self._is_known(key, value):
+                _LOGGER.debug("Schedule %d is up to date, not writing it.", schedule_id)
+            elif not await attempt(key, self._async_write(key, self._client.setSchedule(schedule_id, name, timetable))):
+                continue
+            written.schedules[schedule_id] = (name, timetable)
+
+        # All summer mode assignment changes of the batch are merged into a
+        # single write, followed by at most one summer mode toggle.
+        summer_mode = batch.summer_mode
+        if batch.summer_mode_assign or batch.summer_mode_unassign:
+            try:
+                mask = await self._async_apply_summer_mode_assignments(batch)
+            except Exception as err:
+                # Without the assignments the summer mode wouldn't affect
+                # the right circuits, leave it alone unless set explicitly.
+                failed(("summer_mode_assignments",), err)
+            else:
+                written.summer_mode_assign = batch.summer_mode_assign
+                written.summer_mode_unassign = batch.summer_mode_unassign
+                if summer_mode is None:
+                    if batch.summer_mode_assign:
+                        summer_mode = True
+                    elif not mask:
+                        summer_mode = False
+        if summer_mode is not None:
+            key = ("summer_mode",)
+            if self._is_known(key, summer_mode) or await attempt(
+                key, self._async_write(key, self._client.setSummerMode(summer_mode))
+            ):
+                written.summer_mode = summer_mode
+
+        for circuit_id, (day_schedules, starting_day) in batch.circuit_schedules.items():
+            key = ("circuit_schedules", circuit_id)
+            if self._is_known(key, (tuple(day_schedules), starting_day)) or await attempt(
+                key, self._async_write(key, self._client.setCircuitSchedules(circuit_id, day_schedules, starting_day))
+            ):
+                written.circuit_schedules[circuit_id] = (day_schedules, starting_day)
+
+        if batch.low_mode is not None:
+            enabled, temperature = batch.low_mode
+            key = ("low_mode",)
+            known = self._get_known(key)
+            up_to_date = known is not None and known[0] == enabled and (temperature is None or known[1] == temperature)
+            if up_to_date or await attempt(key, self._async_write(key, self._client.setLowMode(enabled, temperature))):
+                written.low_mode = batch.low_mode
+
+        return written, errors
+
+    async def _async_apply_summer_mode_assignments(self, batch):
+        """ Merge the summer mode assignment changes of the batch into the
+            assignments of the controller. Return the resulting mask.
+        """
+        mask = self._get_known(("summer_mode_assignments",))
+        if mask is not None and (mask & ~batch.summer_mode_unassign) | batch.summer_mode_assign == mask:
+            return mask
+        # Read the assignments right before modifying them, other circuits
+        # may have been changed from elsewhere.
+        assignments = await self._client.getSummerModeAssignments()
+        previous = to_mask(assignments)
+        mask = (previous & ~batch.summer_mode_unassign) | batch.summer_mode_assign
+        if mask != previous:
+            await self._async_write(
+                ("summer_mode_assignments",), self._client.saveSummerModeAssignments(from_mask(mask, len(assignments))),
+            )
+        return mask
+
+
+class BmrDebouncedWrite:
+    """ Delay a write until no new value was requested for `delay` seconds
+        and then write only the last requested value. Values superseded
+        during the quiet period are never sent to the controller.
+
+        A value handed to `write` may still wait in the write batcher when a
+        newer value is requested. The optional `withdraw` callback is then
+        called with the older value and returns True if it managed to drop
+        the older write before it was sent, the newer value supersedes it.
+
+        async_request() returns a future resolved once the value (or a value
+        which superseded it) was written.
+    """
+
+    def __init__(self, hass, delay, write, withdraw=None):
+        self._hass = hass
+        self._delay = delay
+        self._write = write
+        self._withdraw = withdraw
+
+        self._value = None
+        self._handle = None
+        self._waiters = []  # futures of the requests waiting for the quiet period
+        self._queued = None  # (value, waiters) handed to `write` last
+        self._writing = 0
+
+    @property
+    def pending(self):
+        """ Return True if a value is waiting for the quiet period to pass or
+            is being written.
+        """
+        return self._handle is not None or self._writing > 0
+
+    @property
+    def value(self):
+        """ The last requested value.
+        """
+        return self._value
+
+    def async_request(self, value):
+        """ Request writing the value, restart the quiet period.
+        """
+        self._value = value
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._queued is not None and self._withdraw is not None and self._withdraw(self._queued[0]):
+            # The requests of the withdrawn value wait for this one now.
+            _, waiters = self._queued
+            self._waiters.extend(waiters)
+            waiters.clear()
+            self._queued = None
+        future = self._hass.loop.create_future()
+        self._waiters.append(future)
+        self._handle = self._hass.loop.call_later(self._delay, self._async_fire)
+        return future
+
+    def _async_fire(self):
+        waiters, self._waiters, self._handle = self._waiters, [], None
+        # Pending until the write finishes, there is no gap before the task
+        # starts.
+        self._writing += 1
+        self._queued = (self._value, waiters)
+        self._hass.async_create_task(self._async_run(self._queued))
+
+    async def _async_run(self, queued):
+        value, waiters = queued
+        error = None
+        try:
+            await self._write(value)
+        except Exception as err:
+            error = err
+        finally:
+            self._writing -= 1
+            if self._queued is queued:
+                self._queued = None
+        for future in waiters:
+            if error is not None:
+                future.set_exception(error)
+                # Don't complain about exceptions nobody retrieved.
+                future.exception()
+            else:
+                future.set_result(None)